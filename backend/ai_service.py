@@ -1,17 +1,402 @@
 """
 Enhanced AI service with improved prompts for quiz and related topics generation
 """
+import asyncio
+from collections import Counter
+from functools import lru_cache
 import google.generativeai as genai
-from typing import List, Dict
-import json
+from typing import AsyncIterator, List, Dict, Optional, Set, Tuple
 import re
 import logging
+import orjson
+import threading
 import time
-from tenacity import retry, stop_after_attempt, wait_exponential
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from config import settings
+from llm_cache import llm_cache, SemanticCache
 
 logger = logging.getLogger(__name__)
 
+_CODEBLOCK_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+_RELATED_RE = re.compile(r'\{.*"related_topics".*\}', re.DOTALL)
+
+# Static quiz prompt scaffolding, rendered once per request with str.format
+_QUIZ_PROMPT_TEMPLATE = """You are an expert quiz generator. Create a quiz about "{title}" based on the Wikipedia article content below.
+
+IMPORTANT: Return ONLY valid JSON. No markdown, no explanation, just the JSON object.
+- Use double quotes for all strings
+- Escape any quotes inside strings with backslash
+- Do not use single quotes
+- No trailing commas
+
+Generate {num_questions} multiple-choice questions.
+
+Article Title: {title}
+Article Content: {content}
+
+Return this exact JSON structure:
+{{
+  "questions": [
+    {{
+      "question": "What is the question?",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "answer": "Option A",
+      "difficulty": "easy",
+      "explanation": "Brief explanation.",
+      "section": "General"
+    }}
+  ]
+}}
+
+Rules:
+- Each question has exactly 4 options
+- answer must match one of the options exactly  
+- difficulty is "easy", "medium", or "hard"
+- Return ONLY the JSON, nothing else
+
+Generate the quiz now:""".format
+
+# Multi-article prompt used when concurrent requests are batched together
+_BATCH_QUIZ_PROMPT_TEMPLATE = """You are an expert quiz generator. For each Wikipedia article below, create a quiz based on that article's content.
+
+IMPORTANT: Return ONLY valid JSON. No markdown, no explanation, just the JSON object.
+- Use double quotes for all strings
+- Escape any quotes inside strings with backslash
+- Do not use single quotes
+- No trailing commas
+
+{articles}
+Return this exact JSON structure, with one entry per article and "id" set to the article number:
+{{
+  "quizzes": [
+    {{
+      "id": 1,
+      "questions": [
+        {{
+          "question": "What is the question?",
+          "options": ["Option A", "Option B", "Option C", "Option D"],
+          "answer": "Option A",
+          "difficulty": "easy",
+          "explanation": "Brief explanation.",
+          "section": "General"
+        }}
+      ]
+    }}
+  ]
+}}
+
+Rules:
+- Generate exactly the requested number of questions for each article
+- Each question has exactly 4 options
+- answer must match one of the options exactly
+- difficulty is "easy", "medium", or "hard"
+- Return ONLY the JSON, nothing else
+
+Generate the quizzes now:""".format
+
+_BATCH_ARTICLE_TEMPLATE = """Article {id}: {title}
+Generate {num_questions} multiple-choice questions.
+Article Content: {content}
+""".format
+
+# Rough chars-per-token ratio used when no tokenizer is installed
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    """Load the tiktoken encoder once (optional dependency); None means estimate by chars"""
+    try:
+        import tiktoken
+        
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _truncate_to_token_budget(content: str, budget: int) -> str:
+    """
+    Fit article content into a token budget without biasing toward the lead.
+    
+    Long articles are cut to three spans - the opening, the middle and the end -
+    sharing the budget 40/30/30, so questions cover the whole article.
+    """
+    encoder = _get_tokenizer()
+    if encoder is not None:
+        tokens = encoder.encode(content)
+        decode = encoder.decode
+    else:
+        tokens = content
+        decode = str
+        budget *= _CHARS_PER_TOKEN
+    
+    if len(tokens) <= budget:
+        return content
+    
+    head = int(budget * 0.4)
+    middle = int(budget * 0.3)
+    tail = budget - head - middle
+    middle_start = (len(tokens) - middle) // 2
+    
+    spans = (
+        tokens[:head],
+        tokens[middle_start:middle_start + middle],
+        tokens[len(tokens) - tail:],
+    )
+    return " ... ".join(decode(span).strip() for span in spans)
+
+
+# Control characters stripped as a last resort before re-parsing
+_CONTROL_CHARS = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0)])
+
+
+def _extract_json_object(text: str) -> str:
+    """
+    Extract the first balanced JSON object from an AI response in one pass.
+    
+    Tracks brace depth and string/escape state so braces inside strings are
+    ignored, and repairs common model mistakes on the way through: raw
+    newlines/tabs inside strings, invalid \\' and \\? escapes, and trailing
+    commas before a closing brace or bracket. Returns an empty string when the
+    text contains no object.
+    """
+    start = text.find('{')
+    if start == -1:
+        return ""
+    
+    out = []
+    depth = 0
+    in_string = False
+    escape = False
+    
+    for c in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+                if c in "'?":
+                    out[-1] = c  # replace the backslash
+                    continue
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            elif c in '\n\r\t':
+                c = ' '
+            out.append(c)
+            continue
+        
+        if c == '"':
+            in_string = True
+        elif c == '{' or c == '[':
+            depth += 1
+        elif c == '}' or c == ']':
+            # Drop a trailing comma before the closing token
+            i = len(out) - 1
+            while i >= 0 and out[i].isspace():
+                i -= 1
+            if i >= 0 and out[i] == ',':
+                del out[i]
+            depth -= 1
+            if depth == 0:
+                out.append(c)
+                break
+        out.append(c)
+    
+    return ''.join(out)
+
+
+class IncrementalQuestionParser:
+    """
+    Stateful parser for a streamed quiz response.
+    
+    Feed text chunks as they arrive; each call returns the elements of the
+    top-level "questions" array completed by that chunk, so early questions
+    can be validated while later ones are still being generated.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._done = False
+    
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume a chunk and return any newly completed question objects"""
+        self.text += chunk
+        text = self.text
+        items = []
+        
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            
+            if c == '"':
+                self._in_string = True
+            elif c == '{' or c == '[':
+                if self._array_depth is None:
+                    if c == '[' and self._depth == 1 and self._follows_questions_key(i):
+                        self._array_depth = self._depth + 1
+                elif c == '{' and self._depth == self._array_depth and not self._done:
+                    self._item_start = i
+                self._depth += 1
+            elif c == '}' or c == ']':
+                self._depth -= 1
+                if self._array_depth is None or self._done:
+                    continue
+                if c == '}' and self._depth == self._array_depth and self._item_start is not None:
+                    item = self._parse_item(text[self._item_start:i + 1])
+                    if item is not None:
+                        items.append(item)
+                    self._item_start = None
+                elif c == ']' and self._depth < self._array_depth:
+                    self._done = True
+        
+        self._pos = len(text)
+        return items
+    
+    def _follows_questions_key(self, i: int) -> bool:
+        before = self.text[max(0, i - 64):i].rstrip()
+        return before.endswith(':') and before[:-1].rstrip().endswith('"questions"')
+    
+    @staticmethod
+    def _parse_item(raw: str) -> Optional[Dict]:
+        try:
+            item = orjson.loads(_extract_json_object(raw))
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"Skipping unparseable streamed question: {e}")
+            return None
+        return item if isinstance(item, dict) else None
+
+
+class QuizBatcher:
+    """
+    Coalesces concurrent quiz requests into a single multi-article Gemini call.
+    
+    Callers enqueue their article and await a future. A background task
+    collects requests for up to ``window`` seconds or ``max_size`` items, sends
+    one numbered prompt and resolves each future with that article's
+    questions. Articles missing from the batched response are retried with
+    their own call.
+    """
+    
+    def __init__(self, service: "EnhancedAIService", window: float = 0.05, max_size: int = 5):
+        self.service = service
+        self.window = window
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+    
+    async def submit(
+        self,
+        title: str,
+        summary: str,
+        content: str,
+        sections: List[str],
+        num_questions: int
+    ) -> List[Dict]:
+        """Queue an article for the next batch and wait for its questions"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        article = {
+            "title": title,
+            "summary": summary,
+            "content": content,
+            "sections": sections,
+            "num_questions": num_questions,
+        }
+        await self._queue.put((article, future))
+        return await future
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Flush in the background so the next batch can start collecting
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, batch: List[Tuple[Dict, asyncio.Future]]) -> None:
+        service = self.service
+        
+        if len(batch) == 1:
+            article, future = batch[0]
+            await self._resolve(future, service._request_quiz_questions(**article))
+            return
+        
+        logger.info(f"Generating {len(batch)} quizzes in one batched call")
+        articles = [article for article, _ in batch]
+        generation_config = {
+            **service.generation_config,
+            "max_output_tokens": service.generation_config["max_output_tokens"] * len(batch),
+        }
+        
+        try:
+            prompt = await service._create_batch_prompt(articles)
+            async with service._semaphore:
+                response = await service._generate_content(prompt, generation_config=generation_config)
+            quizzes = service._parse_batch_response(response.text)
+        except Exception as e:
+            logger.warning(f"Batched generation failed, falling back to individual calls: {e}")
+            quizzes = {}
+        
+        fallbacks = []
+        for i, (article, future) in enumerate(batch, 1):
+            questions = [
+                q for q in (
+                    service._validate_question(q, article["sections"], j)
+                    for j, q in enumerate(quizzes.get(i, []))
+                )
+                if q is not None
+            ]
+            if future.done():
+                continue
+            if questions:
+                future.set_result(questions)
+            else:
+                fallbacks.append(self._resolve(future, service._request_quiz_questions(**article)))
+        
+        if fallbacks:
+            await asyncio.gather(*fallbacks)
+    
+    @staticmethod
+    async def _resolve(future: asyncio.Future, coro) -> None:
+        try:
+            result = await coro
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
 
 class EnhancedAIService:
     """
@@ -21,30 +406,108 @@ class EnhancedAIService:
     def __init__(self):
         if not settings.google_api_key:
             logger.warning("GOOGLE_API_KEY not set - AI features will not work")
-            self.model = None
-        else:
-            genai.configure(api_key=settings.google_api_key)
-            self.model = genai.GenerativeModel(settings.ai_model)
+        # Built on first use and shared by every request in this worker
+        self.model = None
+        self._model_lock = asyncio.Lock()
         self.generation_config = {
             "temperature": 0.7,
             "max_output_tokens": 4096,
         }
+        self.semantic_cache = SemanticCache() if settings.semantic_cache_enabled else None
+        # Bounds in-flight Gemini calls across concurrent requests
+        self._semaphore = asyncio.Semaphore(settings.ai_max_concurrency)
+        # LLMLingua is loaded on the first compressed prompt, not at import time
+        self.compressor = None
+        self._compressor_loaded = False
+        self._compressor_lock = threading.Lock()
+        self.batcher = QuizBatcher(
+            self,
+            window=settings.ai_batch_window_ms / 1000,
+            max_size=settings.ai_batch_max_size
+        ) if settings.ai_batching_enabled else None
+    
+    def _create_compressor(self):
+        """Load the LLMLingua-2 prompt compressor (optional dependency)"""
+        try:
+            from llmlingua import PromptCompressor
+            
+            return PromptCompressor(
+                model_name=settings.prompt_compression_model,
+                use_llmlingua2=True
+            )
+        except Exception as e:
+            logger.warning(f"Prompt compression disabled - failed to load LLMLingua: {e}")
+            return None
+    
+    def _get_compressor(self):
+        """Load the compressor once, from whichever worker thread needs it first"""
+        if not self._compressor_loaded:
+            with self._compressor_lock:
+                if not self._compressor_loaded:
+                    self.compressor = self._create_compressor()
+                    self._compressor_loaded = True
+        return self.compressor
+    
+    def _compress_content(self, content: str) -> str:
+        """Compress article content to cut prompt tokens; falls back to the original text"""
+        compressor = self._get_compressor()
+        if compressor is None:
+            return content
+        
+        try:
+            result = compressor.compress_prompt(
+                content,
+                rate=settings.prompt_compression_rate,
+                force_tokens=['\n', '?', '.']
+            )
+            return result['compressed_prompt']
+        except Exception as e:
+            logger.warning(f"Prompt compression failed, using raw content: {e}")
+            return content
+    
+    async def _ensure_model(self):
+        """Configure Gemini and build the model once, even under concurrent cold starts"""
+        if self.model is None:
+            async with self._model_lock:
+                if self.model is None:
+                    genai.configure(api_key=settings.google_api_key, transport="grpc_asyncio")
+                    self.model = genai.GenerativeModel(settings.ai_model)
+        return self.model
     
     @retry(
         stop=stop_after_attempt(2),
-        wait=wait_exponential(multiplier=1, min=4, max=20)
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        retry=retry_if_exception_type((google_exceptions.ServiceUnavailable, TimeoutError)),
+        reraise=True
     )
-    def generate_comprehensive_quiz(
+    async def _generate_content(
+        self,
+        prompt: str,
+        stream: bool = False,
+        generation_config: Optional[Dict] = None
+    ):
+        """Call Gemini, retrying only transient failures (never InvalidArgument)"""
+        return await self.model.generate_content_async(
+            prompt,
+            generation_config=generation_config or self.generation_config,
+            stream=stream
+        )
+    
+    async def generate_comprehensive_quiz(
         self,
         title: str,
         summary: str,
         content: str,
         sections: List[str],
-        num_questions: int = 10
+        num_questions: int = 10,
+        refresh: bool = False
     ) -> Dict:
         """
         Generate comprehensive quiz with questions, explanations, and metadata
         
+        With refresh=True both caches are skipped and the model is called again;
+        the new result still replaces the cached one.
+        
         Returns:
             Dict containing:
             - questions: List of quiz questions
@@ -54,43 +517,76 @@ class EnhancedAIService:
         logger.info(f"Generating comprehensive quiz for: {title}")
         start_time = time.time()
         
+        # Serve repeated requests from cache
+        cache_key = llm_cache.make_key(title, num_questions, content)
+        cached = None if refresh else await llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Quiz cache hit for: {title}")
+            return {**cached, "generation_time": time.time() - start_time}
+        
+        if self.semantic_cache and not refresh:
+            cached = await self._semantic_cache_get(summary, num_questions)
+            if cached is not None:
+                await llm_cache.set(cache_key, cached, ttl=settings.cache_ttl)
+                return {**cached, "generation_time": time.time() - start_time}
+        
         # Check if API key is configured
-        if not self.model:
+        if not settings.google_api_key:
             raise Exception("GOOGLE_API_KEY not configured. Please set it in environment variables.")
+        await self._ensure_model()
         
         try:
-            # Generate quiz questions
-            questions = self._generate_quiz_questions(
-                title, summary, content, sections, num_questions
-            )
-            
-            # Generate related topics
-            related_topics = self._generate_related_topics(
-                title, summary, content
+            # Generate quiz questions and related topics concurrently
+            questions, related_topics = await asyncio.gather(
+                self._generate_quiz_questions(
+                    title, summary, content, sections, num_questions
+                ),
+                self._generate_related_topics(title, summary, content),
             )
             
             # Calculate difficulty distribution
+            counts = Counter(q.get("difficulty", "medium") for q in questions)
             difficulty_dist = {
-                "easy": sum(1 for q in questions if q.get("difficulty") == "easy"),
-                "medium": sum(1 for q in questions if q.get("difficulty") == "medium"),
-                "hard": sum(1 for q in questions if q.get("difficulty") == "hard"),
+                "easy": counts["easy"],
+                "medium": counts["medium"],
+                "hard": counts["hard"],
             }
             
             generation_time = time.time() - start_time
             logger.info(f"Quiz generated successfully in {generation_time:.2f}s")
             
-            return {
+            result = {
                 "questions": questions,
                 "related_topics": related_topics,
                 "difficulty_distribution": difficulty_dist,
                 "generation_time": generation_time
             }
+            await llm_cache.set(cache_key, result, ttl=settings.cache_ttl)
+            if self.semantic_cache:
+                await self._semantic_cache_set(summary, num_questions, result)
             
+            return result
+        
         except Exception as e:
             logger.error(f"Failed to generate quiz: {e}")
             raise Exception(f"AI generation failed: {str(e)}")
     
-    def _generate_quiz_questions(
+    async def _semantic_cache_get(self, summary: str, num_questions: int) -> Optional[Dict]:
+        """Look up a near-duplicate article; cache errors never fail generation"""
+        # Embedding (and the first model load) is CPU-bound, so keep it off the event loop
+        try:
+            return await asyncio.to_thread(self.semantic_cache.get, summary, num_questions)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None
+    
+    async def _semantic_cache_set(self, summary: str, num_questions: int, result: Dict) -> None:
+        try:
+            await asyncio.to_thread(self.semantic_cache.set, summary, num_questions, result)
+        except Exception as e:
+            logger.warning(f"Semantic cache update failed: {e}")
+    
+    async def _generate_quiz_questions(
         self,
         title: str,
         summary: str,
@@ -100,76 +596,124 @@ class EnhancedAIService:
     ) -> List[Dict]:
         """Generate quiz questions using optimized prompt"""
         
-        prompt = self._create_quiz_prompt(title, summary, content, sections, num_questions)
-        
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
-            )
-            
-            questions = self._parse_quiz_response(response.text, sections)
+            if self.batcher is not None:
+                questions = await self.batcher.submit(title, summary, content, sections, num_questions)
+            else:
+                questions = await self._request_quiz_questions(
+                    title, summary, content, sections, num_questions
+                )
             return questions[:num_questions]
-            
+        
         except Exception as e:
             logger.error(f"Failed to generate questions: {e}")
             raise
     
-    def _create_quiz_prompt(
+    async def _request_quiz_questions(
         self,
         title: str,
         summary: str,
         content: str,
         sections: List[str],
         num_questions: int
-    ) -> str:
+    ) -> List[Dict]:
+        """Generate questions for a single article with its own Gemini call"""
+        if settings.ai_streaming_enabled:
+            return [
+                q async for q in self.stream_quiz_questions(
+                    title, summary, content, sections, num_questions
+                )
+            ]
+        
+        prompt = await self._create_quiz_prompt(title, summary, content, sections, num_questions)
+        async with self._semaphore:
+            response = await self._generate_content(prompt)
+        
+        return self._parse_quiz_response(response.text, sections)
+    
+    async def stream_quiz_questions(
+        self,
+        title: str,
+        summary: str,
+        content: str,
+        sections: List[str],
+        num_questions: int
+    ) -> AsyncIterator[Dict]:
         """
-        Create optimized prompt for quiz generation with grounding
+        Yield validated quiz questions as the Gemini response streams in.
+        
+        Falls back to parsing the full buffered response when no question
+        could be extracted incrementally.
         """
+        prompt = await self._create_quiz_prompt(title, summary, content, sections, num_questions)
+        parser = IncrementalQuestionParser()
+        count = 0
         
-        # Limit content length to fit within token limits
-        max_content_length = 5000
-        if len(content) > max_content_length:
-            content = content[:max_content_length] + "..."
+        async with self._semaphore:
+            response = await self._generate_content(prompt, stream=True)
+            async for chunk in response:
+                for q in parser.feed(self._chunk_text(chunk)):
+                    q = self._validate_question(q, sections, count)
+                    count += 1
+                    if q is not None:
+                        yield q
         
-        sections_text = ", ".join(sections[:10]) if sections else "N/A"
+        if count == 0:
+            logger.warning("No questions parsed from stream, parsing full response")
+            for q in self._parse_quiz_response(parser.text, sections):
+                yield q
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Text of a streamed chunk; chunks without text parts yield an empty string"""
+        try:
+            return chunk.text
+        except ValueError:
+            return ""
+    
+    async def _create_quiz_prompt(
+        self,
+        title: str,
+        summary: str,
+        content: str,
+        sections: List[str],
+        num_questions: int
+    ) -> str:
+        """
+        Create optimized prompt for quiz generation with grounding
+        """
+        content = await self._prepare_content(content)
+        return _QUIZ_PROMPT_TEMPLATE(title=title, content=content, num_questions=num_questions)
+    
+    async def _create_batch_prompt(self, articles: List[Dict]) -> str:
+        """Create one prompt asking for a quiz per article, numbered from 1"""
+        blocks = "\n".join([
+            _BATCH_ARTICLE_TEMPLATE(
+                id=i,
+                title=article["title"],
+                num_questions=article["num_questions"],
+                content=await self._prepare_content(article["content"])
+            )
+            for i, article in enumerate(articles, 1)
+        ])
+        return _BATCH_QUIZ_PROMPT_TEMPLATE(articles=blocks)
+    
+    async def _prepare_content(self, content: str) -> str:
+        """Fit article content to the prompt budget"""
+        # Tokenizing the whole article (and tiktoken's first-use BPE download) and
+        # LLMLingua's local model are blocking work, so keep them off the event loop
+        return await asyncio.to_thread(self._fit_content, content)
+    
+    def _fit_content(self, content: str) -> str:
+        """Blocking part of _prepare_content; runs in a worker thread"""
+        # Limit content to the token budget, sampling spans across the article
+        content = _truncate_to_token_budget(content, settings.ai_prompt_content_tokens)
         
-        prompt = f"""You are an expert quiz generator. Create a quiz about "{title}" based on the Wikipedia article content below.
-
-IMPORTANT: Return ONLY valid JSON. No markdown, no explanation, just the JSON object.
-- Use double quotes for all strings
-- Escape any quotes inside strings with backslash
-- Do not use single quotes
-- No trailing commas
-
-Generate {num_questions} multiple-choice questions.
-
-Article Title: {title}
-Article Content: {content}
-
-Return this exact JSON structure:
-{{
-  "questions": [
-    {{
-      "question": "What is the question?",
-      "options": ["Option A", "Option B", "Option C", "Option D"],
-      "answer": "Option A",
-      "difficulty": "easy",
-      "explanation": "Brief explanation.",
-      "section": "General"
-    }}
-  ]
-}}
-
-Rules:
-- Each question has exactly 4 options
-- answer must match one of the options exactly  
-- difficulty is "easy", "medium", or "hard"
-- Return ONLY the JSON, nothing else
-
-Generate the quiz now:"""
+        # Compress the article body only; title and instructions stay verbatim
+        if settings.prompt_compression_enabled:
+            content = self._compress_content(content)
         
-        return prompt
+        return content
     
     def _parse_quiz_response(self, response_text: str, sections: List[str]) -> List[Dict]:
         """Parse AI response into structured quiz questions"""
@@ -179,100 +723,29 @@ Generate the quiz now:"""
             response_text = response_text.strip()
             logger.debug(f"Raw AI response (first 500 chars): {response_text[:500]}")
             
-            # Try multiple extraction methods
-            json_text = None
-            
-            # Method 1: Extract from code blocks
-            json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(1).strip()
-            
-            # Method 2: Find JSON object with balanced braces
-            if not json_text:
-                # Find first { and match to closing }
-                start = response_text.find('{')
-                if start != -1:
-                    brace_count = 0
-                    end = start
-                    for i, c in enumerate(response_text[start:], start):
-                        if c == '{':
-                            brace_count += 1
-                        elif c == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                end = i + 1
-                                break
-                    json_text = response_text[start:end]
-            
+            json_text = _extract_json_object(response_text)
             if not json_text:
                 raise ValueError("No JSON found in response")
             
-            # Clean common JSON issues
-            # Remove newlines within strings but keep structure
-            json_text = re.sub(r'(?<!\\)\n', ' ', json_text)
-            
-            # Fix invalid escape sequences that AI commonly produces
-            json_text = json_text.replace("\\'", "'")  # \' is not valid JSON escape
-            json_text = json_text.replace("\\?", "?")  # \? is not valid JSON escape
-            
-            # Fix trailing commas
-            json_text = re.sub(r',\s*}', '}', json_text)
-            json_text = re.sub(r',\s*]', ']', json_text)
-            
             try:
-                data = json.loads(json_text)
-            except json.JSONDecodeError as e:
+                data = orjson.loads(json_text)
+            except orjson.JSONDecodeError as e:
                 logger.error(f"JSON parse error at position {e.pos}: {json_text[max(0,e.pos-50):e.pos+50]}")
-                # Try one more fix - replace problematic characters
-                json_text = json_text.replace('\t', ' ')
-                json_text = json_text.replace("\\'", "'")  # Fix invalid escape for single quotes
-                json_text = json_text.replace("\\?", "?")  # Fix invalid escape for question marks
-                json_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', json_text)
-                data = json.loads(json_text)
+                # Try one more fix - strip stray control characters
+                data = orjson.loads(json_text.translate(_CONTROL_CHARS))
             
             questions = data.get('questions', [])
             
             # Validate and clean questions
             validated_questions = []
             for i, q in enumerate(questions):
-                try:
-                    # Ensure required fields
-                    if not all(key in q for key in ['question', 'options', 'answer', 'difficulty']):
-                        logger.warning(f"Skipping question {i+1}: missing required fields")
-                        continue
-                    
-                    # Validate options
-                    if len(q['options']) != 4:
-                        logger.warning(f"Skipping question {i+1}: must have exactly 4 options")
-                        continue
-                    
-                    # Validate answer is in options
-                    if q['answer'] not in q['options']:
-                        logger.warning(f"Skipping question {i+1}: answer not in options")
-                        continue
-                    
-                    # Validate difficulty
-                    if q['difficulty'] not in ['easy', 'medium', 'hard']:
-                        q['difficulty'] = 'medium'  # Default
-                    
-                    # Ensure section is present
-                    if 'section' not in q or not q['section']:
-                        # Try to find relevant section
-                        q['section'] = sections[0] if sections else "General"
-                    
-                    # Ensure explanation is present
-                    if 'explanation' not in q or not q['explanation']:
-                        q['explanation'] = "Based on article content."
-                    
+                q = self._validate_question(q, sections, i)
+                if q is not None:
                     validated_questions.append(q)
-                    
-                except Exception as e:
-                    logger.warning(f"Error validating question {i+1}: {e}")
-                    continue
             
             return validated_questions
-            
-        except json.JSONDecodeError as e:
+        
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {e}")
             logger.debug(f"Response text: {response_text[:500]}")
             raise Exception("AI response was not valid JSON")
@@ -280,7 +753,61 @@ Generate the quiz now:"""
             logger.error(f"Error parsing quiz response: {e}")
             raise
     
-    def _generate_related_topics(
+    def _parse_batch_response(self, response_text: str) -> Dict[int, List[Dict]]:
+        """Parse a batched AI response into raw question lists keyed by article number"""
+        json_text = _extract_json_object(response_text.strip())
+        if not json_text:
+            raise ValueError("No JSON found in batch response")
+        
+        try:
+            data = orjson.loads(json_text)
+        except orjson.JSONDecodeError:
+            data = orjson.loads(json_text.translate(_CONTROL_CHARS))
+        
+        quizzes = {}
+        for quiz in data.get('quizzes', []):
+            if isinstance(quiz, dict) and isinstance(quiz.get('id'), int):
+                quizzes[quiz['id']] = quiz.get('questions', [])
+        return quizzes
+    
+    def _validate_question(self, q: Dict, sections: List[str], i: int) -> Optional[Dict]:
+        """Validate and normalize a single question; returns None if it should be skipped"""
+        try:
+            # Ensure required fields
+            if not all(key in q for key in ['question', 'options', 'answer', 'difficulty']):
+                logger.warning(f"Skipping question {i+1}: missing required fields")
+                return None
+            
+            # Validate options
+            if len(q['options']) != 4:
+                logger.warning(f"Skipping question {i+1}: must have exactly 4 options")
+                return None
+            
+            # Validate answer is in options
+            if q['answer'] not in q['options']:
+                logger.warning(f"Skipping question {i+1}: answer not in options")
+                return None
+            
+            # Validate difficulty
+            if q['difficulty'] not in ['easy', 'medium', 'hard']:
+                q['difficulty'] = 'medium'  # Default
+            
+            # Ensure section is present
+            if 'section' not in q or not q['section']:
+                # Try to find relevant section
+                q['section'] = sections[0] if sections else "General"
+            
+            # Ensure explanation is present
+            if 'explanation' not in q or not q['explanation']:
+                q['explanation'] = "Based on article content."
+            
+            return q
+        
+        except Exception as e:
+            logger.warning(f"Error validating question {i+1}: {e}")
+            return None
+    
+    async def _generate_related_topics(
         self,
         title: str,
         summary: str,
@@ -314,32 +841,30 @@ Generate the quiz now:"""
 ```
 
 Generate the related topics now:"""
-        
+
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
-            )
+            async with self._semaphore:
+                response = await self._generate_content(prompt)
             
             # Parse response
-            json_match = re.search(r'```json\s*(.*?)\s*```', response.text, re.DOTALL)
+            json_match = _CODEBLOCK_RE.search(response.text)
             if json_match:
                 json_text = json_match.group(1)
             else:
-                json_match = re.search(r'\{.*"related_topics".*\}', response.text, re.DOTALL)
+                json_match = _RELATED_RE.search(response.text)
                 if json_match:
                     json_text = json_match.group(0)
                 else:
                     json_text = response.text
             
-            data = json.loads(json_text)
+            data = orjson.loads(json_text)
             related_topics = data.get('related_topics', [])
             
             # Validate and clean
             related_topics = [t.strip() for t in related_topics if isinstance(t, str) and len(t.strip()) > 2]
             
             return related_topics[:8]  # Limit to 8 topics
-            
+        
         except Exception as e:
             logger.warning(f"Failed to generate related topics: {e}")
             # Return empty list on failure
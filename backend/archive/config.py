@@ -26,6 +26,7 @@ class Settings(BaseSettings):
     ai_temperature: float = 0.7
     ai_max_tokens: int = 2048
     ai_timeout: int = 30
+    ai_max_concurrency: int = 8  # Max in-flight Gemini calls per worker
     
     # Rate Limiting
     rate_limit_enabled: bool = True
@@ -56,6 +57,7 @@ class Settings(BaseSettings):
     wikipedia_timeout: int = 10
     wikipedia_retries: int = 3
     wikipedia_user_agent: str = "WikiQuizBot/2.0 (Educational Purpose)"
+    wikipedia_cache_ttl: int = 86400  # Article text changes rarely; 1 day
     
     # Quiz Configuration
     max_questions_per_quiz: int = 20
@@ -0,0 +1,39 @@
+"""
+Shared pytest fixtures for the Wiki Quiz Generator test suite
+"""
+import os
+import sys
+
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main_enhanced import app
+from services import ai_service, wikipedia_service
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient (and one lifespan cycle) shared by the whole session"""
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def wiki_mock(monkeypatch):
+    """Stub out the shared WikipediaService article lookup"""
+    mock = AsyncMock()
+    monkeypatch.setattr(wikipedia_service, "get_article_summary", mock)
+    return mock
+
+
+@pytest.fixture
+def ai_mock(monkeypatch):
+    """Stub out the shared AIService quiz generation"""
+    mock = AsyncMock()
+    monkeypatch.setattr(ai_service, "generate_quiz", mock)
+    return mock
@@ -2,19 +2,22 @@
 Wiki Quiz Generator - Production Server
 Google Gemini AI + Wikipedia Scraping
 """
+import itertools
 import logging
 import os
-from typing import Dict, List
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
 from datetime import datetime
 from dotenv import load_dotenv
+from cachetools import LRUCache
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, HttpUrl
-import requests
-from bs4 import BeautifulSoup
-import html2text
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 import google.generativeai as genai
 import json
 
@@ -58,9 +61,38 @@ else:
         logger.error(f"❌ Failed to initialize Gemini: {e}")
         model = None
 
+# Pooled HTTP client for Wikipedia, opened on startup and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+
 # In-memory storage (can be replaced with database)
-articles_db = {}
-quizzes_db = {}
+MAX_CACHED_QUIZZES = int(os.getenv("MAX_CACHED_QUIZZES", "10000"))
+
+
+class QuizStore(LRUCache):
+    """Bounded LRU quiz store with an insertion-ordered summary index for listing"""
+    
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.index: "OrderedDict[str, Dict]" = OrderedDict()
+    
+    def __setitem__(self, quiz_id: str, quiz: Dict):
+        super().__setitem__(quiz_id, quiz)
+        self.index[quiz_id] = {
+            "id": quiz_id,
+            "title": quiz["article_title"],
+            "num_questions": len(quiz["questions"]),
+            "created_at": quiz["created_at"]
+        }
+    
+    def __delitem__(self, quiz_id: str):
+        # Also called by popitem() when the LRU evicts an entry
+        super().__delitem__(quiz_id)
+        self.index.pop(quiz_id, None)
+
+
+articles_db = LRUCache(maxsize=MAX_CACHED_QUIZZES)
+quizzes_db = QuizStore(maxsize=MAX_CACHED_QUIZZES)
+quiz_counter = itertools.count(1)
 
 # ============================================================================
 # Pydantic Models
@@ -94,7 +126,89 @@ class HealthResponse(BaseModel):
 # Core Functions
 # ============================================================================
 
-def scrape_wikipedia(url: str) -> Dict[str, str]:
+WIKIPEDIA_API_HOST = "en.wikipedia.org"
+MAX_HTML_BYTES = 2_000_000
+
+
+async def fetch_from_api(title: str, headers: Dict[str, str]) -> Tuple[str, str]:
+    """Fetch title and plain-text body from the Wikipedia REST and Action APIs"""
+    summary = await http_client.get(
+        f"https://{WIKIPEDIA_API_HOST}/api/rest_v1/page/summary/{quote(title, safe='')}",
+        headers=headers,
+        timeout=15
+    )
+    summary.raise_for_status()
+    summary_data = summary.json()
+    
+    # The REST API has no plain-text body endpoint; the Action API's
+    # extracts module returns the whole article as plain text
+    extract = await http_client.get(
+        f"https://{WIKIPEDIA_API_HOST}/w/api.php",
+        params={
+            "action": "query",
+            "prop": "extracts",
+            "explaintext": 1,
+            "redirects": 1,
+            "titles": summary_data.get("title", title),
+            "format": "json",
+            "formatversion": 2,
+        },
+        headers=headers,
+        timeout=15
+    )
+    extract.raise_for_status()
+    pages = extract.json().get("query", {}).get("pages", [])
+    body = pages[0].get("extract", "") if pages else ""
+    
+    text_content = body or summary_data.get("extract", "")
+    if not text_content:
+        raise ValueError("Could not find article content")
+    
+    return summary_data.get("title", title), text_content
+
+
+async def scrape_html(url: str, headers: Dict[str, str]) -> Tuple[str, str]:
+    """Scrape title and text from the rendered article HTML"""
+    # Stream the page and stop at the size cap; the parser copes with truncated HTML
+    buf = bytearray()
+    async with http_client.stream("GET", url, headers=headers, timeout=15) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(65536):
+            buf.extend(chunk)
+            if len(buf) > MAX_HTML_BYTES:
+                logger.warning(f"Article HTML exceeds {MAX_HTML_BYTES} bytes, truncating: {url}")
+                break
+    
+    tree = LexborHTMLParser(bytes(buf))
+    
+    # Extract title
+    title = tree.css_first('h1.firstHeading')
+    title_text = title.text().strip() if title else "Unknown Article"
+    
+    # Extract main content
+    content_div = tree.css_first('div.mw-parser-output')
+    if not content_div:
+        raise ValueError("Could not find article content")
+    
+    # Remove unwanted elements
+    for unwanted in content_div.css('table, script, style, sup, span.mw-editsection'):
+        unwanted.decompose()
+    
+    # Extract text block by block so inline markup doesn't split sentences,
+    # keeping section structure as markdown-style heading markers
+    blocks = []
+    for node in content_div.css('h2, h3, h4, p, li'):
+        text = node.text().strip()
+        if not text:
+            continue
+        if node.tag in ('h2', 'h3', 'h4'):
+            text = '#' * int(node.tag[1]) + ' ' + text
+        blocks.append(text)
+    
+    return title_text, '\n\n'.join(blocks)
+
+
+async def scrape_wikipedia(url: str) -> Dict[str, str]:
     """Scrape Wikipedia article content"""
     try:
         logger.info(f"📰 Scraping Wikipedia: {url}")
@@ -103,30 +217,12 @@ def scrape_wikipedia(url: str) -> Dict[str, str]:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         
-        response = requests.get(str(url), headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = soup.find('h1', class_='firstHeading')
-        title_text = title.get_text() if title else "Unknown Article"
-        
-        # Extract main content
-        content_div = soup.find('div', class_='mw-parser-output')
-        if not content_div:
-            raise ValueError("Could not find article content")
-        
-        # Remove unwanted elements
-        for unwanted in content_div.find_all(['table', 'script', 'style', 'sup']):
-            unwanted.decompose()
-        
-        # Convert HTML to text
-        h = html2text.HTML2Text()
-        h.ignore_links = True
-        h.ignore_images = True
-        h.ignore_emphasis = False
-        text_content = h.handle(str(content_div))
+        # English Wikipedia serves clean text over its APIs; other hosts are scraped
+        parsed = urlparse(str(url))
+        if parsed.netloc == WIKIPEDIA_API_HOST and parsed.path.startswith('/wiki/'):
+            title_text, text_content = await fetch_from_api(unquote(parsed.path[len('/wiki/'):]), headers)
+        else:
+            title_text, text_content = await scrape_html(str(url), headers)
         
         # Clean and limit content
         text_content = text_content.strip()
@@ -140,7 +236,7 @@ def scrape_wikipedia(url: str) -> Dict[str, str]:
             "url": str(url)
         }
         
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"❌ Network error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch Wikipedia article: {str(e)}")
     except Exception as e:
@@ -148,7 +244,7 @@ def scrape_wikipedia(url: str) -> Dict[str, str]:
         raise HTTPException(status_code=500, detail=f"Failed to scrape article: {str(e)}")
 
 
-def generate_quiz_with_ai(article: Dict, num_questions: int, difficulty: str) -> List[Dict]:
+async def generate_quiz_with_ai(article: Dict, num_questions: int, difficulty: str) -> List[Dict]:
     """Generate quiz questions using Google Gemini AI"""
     if not model:
         raise HTTPException(
@@ -188,7 +284,7 @@ Requirements:
 """
 
         # Generate content with Gemini
-        response = model.generate_content(prompt)
+        response = await model.generate_content_async(prompt)
         result_text = response.text.strip()
         
         # Clean markdown code blocks if present
@@ -261,17 +357,17 @@ async def generate_quiz(request: GenerateRequest):
             raise HTTPException(status_code=400, detail="difficulty must be easy, medium, or hard")
         
         # Step 1: Scrape Wikipedia article
-        article = scrape_wikipedia(request.url)
+        article = await scrape_wikipedia(request.url)
         
         # Step 2: Generate quiz with AI
-        questions = generate_quiz_with_ai(
+        questions = await generate_quiz_with_ai(
             article,
             request.num_questions,
             request.difficulty
         )
         
         # Step 3: Create and store quiz
-        quiz_id = f"quiz_{len(quizzes_db) + 1}_{int(datetime.utcnow().timestamp())}"
+        quiz_id = f"quiz_{next(quiz_counter)}_{int(datetime.utcnow().timestamp())}"
         quiz = {
             "id": quiz_id,
             "article_title": article["title"],
@@ -308,15 +404,7 @@ async def list_quizzes():
     """List all generated quizzes"""
     return {
         "total": len(quizzes_db),
-        "quizzes": [
-            {
-                "id": quiz_id,
-                "title": quiz["article_title"],
-                "num_questions": len(quiz["questions"]),
-                "created_at": quiz["created_at"]
-            }
-            for quiz_id, quiz in quizzes_db.items()
-        ]
+        "quizzes": list(quizzes_db.index.values())
     }
 
 # ============================================================================
@@ -326,6 +414,13 @@ async def list_quizzes():
 @app.on_event("startup")
 async def startup_event():
     """Run on server startup"""
+    global http_client
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        follow_redirects=True
+    )
+    
     logger.info("=" * 80)
     logger.info("🚀 Wiki Quiz Generator - Production Server Starting")
     logger.info("=" * 80)
@@ -334,6 +429,13 @@ async def startup_event():
     logger.info("=" * 80)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Run on server shutdown"""
+    if http_client is not None:
+        await http_client.aclose()
+
+
 if __name__ == "__main__":
     import uvicorn
     
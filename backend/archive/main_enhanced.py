@@ -2,17 +2,28 @@
 Wiki Quiz Generator - Enterprise Production Server v2.0
 Features: Rate Limiting, Caching, Monitoring, Security, Enhanced Error Handling
 """
+import asyncio
+import hashlib
+import importlib.util
+import os
 import time
 from datetime import datetime
+from typing import Optional
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from contextlib import asynccontextmanager
-import uuid
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from secrets import token_hex
 
 # Import our enhanced modules
 from config import settings
 from logger import setup_logging, get_logger
+from metrics import HEALTH_COMPONENT_LATENCY, QUIZ_LATENCY, QUIZ_REQUESTS, render_metrics
 from middleware import (
     RateLimitMiddleware,
     RequestLoggingMiddleware,
@@ -26,6 +37,7 @@ from models import (
     ErrorResponse,
 )
 from services import (
+    create_http_client,
     wikipedia_service,
     ai_service,
     WikipediaException,
@@ -40,6 +52,25 @@ logger = get_logger(__name__)
 # Application start time for uptime tracking
 app_start_time = time.time()
 
+# Generated quizzes are cached in Redis when enabled
+quiz_cache: Optional[Redis] = (
+    Redis.from_url(settings.redis_url) if settings.redis_enabled and settings.redis_url else None
+)
+QUIZ_LOCK_TTL = 30  # seconds other requests wait for an in-flight generation
+
+# Delete the lock only if it still holds our token, so a generation that outlived
+# QUIZ_LOCK_TTL can't release a lock another request has since acquired
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Last Wikipedia reachability result, reused by /health for a few seconds
+HEALTH_CACHE_TTL = 10
+_health_cache = {"ts": 0.0, "wiki_ok": True}
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -53,9 +84,18 @@ async def lifespan(app: FastAPI):
     logger.info(f"⚡ Rate limiting: {'ENABLED' if settings.rate_limit_enabled else 'DISABLED'}")
     logger.info(f"💾 Caching: {'ENABLED' if settings.redis_enabled else 'DISABLED'}")
     
+    # One pooled HTTP/2 client for every outbound Wikipedia request
+    app.state.http = create_http_client()
+    wikipedia_service.use_client(app.state.http)
+    if quiz_cache is not None:
+        wikipedia_service.use_cache(quiz_cache)
+    
     yield
     
     # Shutdown
+    await app.state.http.aclose()
+    if quiz_cache is not None:
+        await quiz_cache.aclose()
     logger.info("👋 Shutting down application")
 
 
@@ -68,9 +108,14 @@ app = FastAPI(
     redoc_url="/redoc",
     openapi_url="/openapi.json",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add middleware (order matters!)
+# GZip is added first so it sits innermost, next to the routes: the
+# BaseHTTPMiddleware layers below re-stream bodies in chunks, which would
+# make it ignore minimum_size if it wrapped them.
+app.add_middleware(GZipMiddleware, minimum_size=512)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(RequestLoggingMiddleware)
 
@@ -79,6 +124,7 @@ if settings.rate_limit_enabled:
         RateLimitMiddleware,
         requests_per_window=settings.rate_limit_requests,
         window_seconds=settings.rate_limit_window,
+        redis_url=settings.redis_url if settings.redis_enabled else None,
     )
 
 # CORS - Configure based on environment
@@ -93,18 +139,54 @@ app.add_middleware(
 
 
 # Exception Handlers
+_ERROR_MESSAGES = {
+    "WikipediaError": "Failed to fetch Wikipedia content. Please check the topic and try again.",
+    "AIServiceError": "AI service temporarily unavailable. Please try again in a moment.",
+    "ServiceError": "Service temporarily unavailable. Circuit breaker may be open.",
+    "InternalServerError": "An unexpected error occurred. Please try again later.",
+}
+
+# Error bodies are serialized once; only the timestamp and path change per request
+_ERROR_BODIES = {
+    error: orjson.dumps({
+        "error": error,
+        "message": message,
+        "details": None,
+        "timestamp": "__TIMESTAMP__",
+        "path": "__PATH__",
+    })
+    for error, message in _ERROR_MESSAGES.items()
+}
+
+
+def _error_response(request: Request, error: str, status_code: int, details: dict) -> Response:
+    """Build an ErrorResponse body; exception details are only included in debug mode"""
+    if settings.debug:
+        return ORJSONResponse(
+            status_code=status_code,
+            content=ErrorResponse(
+                error=error,
+                message=_ERROR_MESSAGES[error],
+                details=details,
+                path=str(request.url.path),
+            ).model_dump(),
+        )
+    
+    body = _ERROR_BODIES[error].replace(
+        b'"__TIMESTAMP__"', orjson.dumps(datetime.utcnow())
+    ).replace(
+        b'"__PATH__"', orjson.dumps(request.url.path)
+    )
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
 @app.exception_handler(WikipediaException)
 async def wikipedia_exception_handler(request: Request, exc: WikipediaException):
     """Handle Wikipedia scraping errors"""
     logger.error(f"Wikipedia error: {exc}")
-    return JSONResponse(
-        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-        content=ErrorResponse(
-            error="WikipediaError",
-            message="Failed to fetch Wikipedia content. Please check the topic and try again.",
-            details={"original_error": str(exc)},
-            path=str(request.url.path),
-        ).model_dump(),
+    return _error_response(
+        request, "WikipediaError", status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"original_error": str(exc)},
     )
 
 
@@ -112,14 +194,9 @@ async def wikipedia_exception_handler(request: Request, exc: WikipediaException)
 async def ai_exception_handler(request: Request, exc: AIServiceException):
     """Handle AI service errors"""
     logger.error(f"AI service error: {exc}")
-    return JSONResponse(
-        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-        content=ErrorResponse(
-            error="AIServiceError",
-            message="AI service temporarily unavailable. Please try again in a moment.",
-            details={"original_error": str(exc)},
-            path=str(request.url.path),
-        ).model_dump(),
+    return _error_response(
+        request, "AIServiceError", status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"original_error": str(exc)},
     )
 
 
@@ -127,14 +204,9 @@ async def ai_exception_handler(request: Request, exc: AIServiceException):
 async def service_exception_handler(request: Request, exc: ServiceException):
     """Handle general service errors"""
     logger.error(f"Service error: {exc}")
-    return JSONResponse(
-        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-        content=ErrorResponse(
-            error="ServiceError",
-            message="Service temporarily unavailable. Circuit breaker may be open.",
-            details={"original_error": str(exc)},
-            path=str(request.url.path),
-        ).model_dump(),
+    return _error_response(
+        request, "ServiceError", status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"original_error": str(exc)},
     )
 
 
@@ -142,14 +214,9 @@ async def service_exception_handler(request: Request, exc: ServiceException):
 async def global_exception_handler(request: Request, exc: Exception):
     """Handle all unhandled exceptions"""
     logger.exception(f"Unhandled exception: {exc}")
-    return JSONResponse(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content=ErrorResponse(
-            error="InternalServerError",
-            message="An unexpected error occurred. Please try again later.",
-            details={"type": type(exc).__name__} if settings.debug else None,
-            path=str(request.url.path),
-        ).model_dump(),
+    return _error_response(
+        request, "InternalServerError", status.HTTP_500_INTERNAL_SERVER_ERROR,
+        {"type": type(exc).__name__},
     )
 
 
@@ -190,15 +257,20 @@ async def health_check():
         "wikipedia": True,
     }
     
-    # Test Wikipedia service
-    try:
-        # Quick test - just check if we can make a request
-        import requests
-        response = requests.get("https://en.wikipedia.org", timeout=5)
-        checks["wikipedia"] = response.status_code == 200
-    except Exception as e:
-        logger.warning(f"Wikipedia health check failed: {e}")
-        checks["wikipedia"] = False
+    # Test Wikipedia service (cached so frequent probes don't each hit Wikipedia)
+    if time.time() - _health_cache["ts"] >= HEALTH_CACHE_TTL:
+        try:
+            async with httpx.AsyncClient(timeout=2) as client:
+                response = await client.head("https://en.wikipedia.org")
+            HEALTH_COMPONENT_LATENCY.labels(component="wikipedia").observe(
+                response.elapsed.total_seconds()
+            )
+            _health_cache["wiki_ok"] = response.status_code < 400
+        except Exception as e:
+            logger.warning(f"Wikipedia health check failed: {e}")
+            _health_cache["wiki_ok"] = False
+        _health_cache["ts"] = time.time()
+    checks["wikipedia"] = _health_cache["wiki_ok"]
     
     # Determine overall status
     if all(checks.values()):
@@ -218,15 +290,60 @@ async def health_check():
     )
 
 
+def _quiz_cache_key(request: QuizGenerationRequest) -> str:
+    """Cache key for a quiz request: topic, question count and difficulty"""
+    key_string = f"{request.topic.strip()}|{request.num_questions}|{request.difficulty.value}"
+    return "quiz:" + hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest()
+
+
+async def _get_cached_quiz(cache_key: str) -> tuple[Optional[bytes], Optional[str]]:
+    """
+    Return (cached quiz, lock token); the quiz is None if this request should generate it
+    
+    On a miss the first request takes a short lock and gets its token back;
+    concurrent requests for the same quiz poll the cache instead of all calling
+    Wikipedia and Gemini, and get no token.
+    """
+    lock_key = f"lock:{cache_key}"
+    try:
+        cached = await quiz_cache.get(cache_key)
+        if cached:
+            return cached, None
+        
+        token = token_hex(16)
+        if await quiz_cache.set(lock_key, token, nx=True, ex=QUIZ_LOCK_TTL):
+            return None, token
+        
+        deadline = time.time() + QUIZ_LOCK_TTL
+        while time.time() < deadline:
+            await asyncio.sleep(0.5)
+            cached = await quiz_cache.get(cache_key)
+            if cached or not await quiz_cache.exists(lock_key):
+                return cached, None
+    except RedisError as e:
+        logger.warning(f"Quiz cache lookup failed: {e}")
+    return None, None
+
+
+async def _store_cached_quiz(cache_key: str, body: Optional[str], lock_token: Optional[str]):
+    """Cache a generated quiz's JSON and release the generation lock if we hold it"""
+    try:
+        if body is not None:
+            await quiz_cache.set(cache_key, body, ex=settings.cache_ttl)
+        if lock_token is not None:
+            await quiz_cache.eval(_RELEASE_LOCK_SCRIPT, 1, f"lock:{cache_key}", lock_token)
+    except RedisError as e:
+        logger.warning(f"Quiz cache store failed: {e}")
+
+
 @app.post(
     "/generate-quiz",
-    response_model=QuizResponse,
     status_code=status.HTTP_200_OK,
     summary="Generate quiz from Wikipedia",
     description="Generate AI-powered quiz questions from any Wikipedia topic",
     tags=["Quiz"],
     responses={
-        200: {"description": "Quiz generated successfully"},
+        200: {"model": QuizResponse, "description": "Quiz generated successfully"},
         400: {"model": ErrorResponse, "description": "Invalid request"},
         503: {"model": ErrorResponse, "description": "Service unavailable"},
         429: {"description": "Rate limit exceeded"},
@@ -247,17 +364,30 @@ async def generate_quiz(request: QuizGenerationRequest):
         f"({request.num_questions} questions, {request.difficulty})"
     )
     
+    start_time = time.perf_counter()
+    cache_key = _quiz_cache_key(request) if quiz_cache is not None else None
+    lock_token = None
+    if cache_key:
+        cached, lock_token = await _get_cached_quiz(cache_key)
+        if cached:
+            logger.info(f"Quiz cache hit: {request.topic}")
+            QUIZ_REQUESTS.labels(status="cache_hit").inc()
+            QUIZ_LATENCY.observe(time.perf_counter() - start_time)
+            return Response(content=cached, media_type="application/json")
+    
+    body = None
+    outcome = "error"
     try:
         # Step 1: Scrape Wikipedia content
         logger.debug("Fetching Wikipedia content...")
-        content = wikipedia_service.get_article_summary(
+        content = await wikipedia_service.get_article_summary(
             request.topic,
             max_length=3000
         )
         
         # Step 2: Generate quiz with AI
         logger.debug("Generating quiz with AI...")
-        questions = ai_service.generate_quiz(
+        questions = await ai_service.generate_quiz(
             content=content,
             num_questions=request.num_questions,
             difficulty=request.difficulty,
@@ -265,7 +395,7 @@ async def generate_quiz(request: QuizGenerationRequest):
         )
         
         # Step 3: Create response
-        quiz_id = f"quiz_{uuid.uuid4().hex[:12]}"
+        quiz_id = f"quiz_{token_hex(6)}"
         estimated_duration = request.num_questions * 2  # 2 minutes per question
         
         response = QuizResponse(
@@ -282,10 +412,15 @@ async def generate_quiz(request: QuizGenerationRequest):
             f"({len(questions)} questions)"
         )
         
-        return response
-        
+        # Serialize once (pydantic-core); the same JSON is cached and returned
+        # without FastAPI re-validating it against a response_model
+        body = response.model_dump_json()
+        outcome = "success"
+        return Response(content=body, media_type="application/json")
+    
     except WikipediaException as e:
         logger.error(f"Wikipedia error for topic '{request.topic}': {e}")
+        outcome = "wikipedia_error"
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail={
@@ -297,6 +432,7 @@ async def generate_quiz(request: QuizGenerationRequest):
     
     except AIServiceException as e:
         logger.error(f"AI generation error for topic '{request.topic}': {e}")
+        outcome = "ai_error"
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail={
@@ -314,6 +450,12 @@ async def generate_quiz(request: QuizGenerationRequest):
                 "message": "An unexpected error occurred. Please try again.",
             },
         )
+    
+    finally:
+        QUIZ_REQUESTS.labels(status=outcome).inc()
+        QUIZ_LATENCY.observe(time.perf_counter() - start_time)
+        if cache_key:
+            await _store_cached_quiz(cache_key, body, lock_token)
 
 
 @app.get(
@@ -327,11 +469,8 @@ async def metrics():
     """
     Expose Prometheus metrics
     """
-    # In production, integrate with prometheus_client
-    return {
-        "uptime_seconds": time.time() - app_start_time,
-        "version": settings.app_version,
-    }
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
 
 
 # Development server runner
@@ -342,10 +481,26 @@ if __name__ == "__main__":
     logger.info(f"📝 API Documentation: http://{settings.host}:{settings.port}/docs")
     logger.info(f"🔍 Health Check: http://{settings.host}:{settings.port}/health")
     
+    # Without Redis the rate limiter counts per process, so extra workers would
+    # multiply the per-IP limit; reload mode is limited to a single worker too
+    shared_state = settings.redis_enabled and bool(settings.redis_url)
+    workers = settings.workers if shared_state and not settings.debug else 1
+    if workers < settings.workers and not settings.debug:
+        logger.warning(
+            f"Running 1 worker instead of {settings.workers}: "
+            "enable Redis so rate limits are shared across workers"
+        )
+    if workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is not set; /metrics will only report one worker")
+    
+    # Prefer uvloop/httptools when installed (uvloop has no Windows build)
     uvicorn.run(
-        "main:app",
+        "main_enhanced:app",
         host=settings.host,
         port=settings.port,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
         reload=settings.debug,
+        workers=workers,
         log_level=settings.log_level.lower(),
     )
@@ -0,0 +1,67 @@
+"""
+Prometheus metrics shared by the API, middleware and services
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "path", "status"],
+)
+QUIZ_REQUESTS = Counter(
+    "quiz_requests_total",
+    "Quiz generation requests by outcome",
+    ["status"],
+)
+QUIZ_LATENCY = Histogram(
+    "quiz_endpoint_seconds",
+    "End-to-end /generate-quiz latency",
+)
+WIKI_LATENCY = Histogram(
+    "wikipedia_fetch_seconds",
+    "Wikipedia page fetch latency",
+)
+AI_LATENCY = Histogram(
+    "ai_generate_seconds",
+    "Gemini generation call latency",
+)
+HEALTH_COMPONENT_LATENCY = Histogram(
+    "health_check_component_latency_seconds",
+    "Latency of dependency checks made by /health",
+    ["component"],
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state (0=closed, 1=half-open, 2=open)",
+    ["breaker"],
+    multiprocess_mode="max",
+)
+
+CIRCUIT_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+
+def render_metrics() -> tuple:
+    """
+    Render metrics in Prometheus text format
+    
+    With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR so every
+    worker's samples are aggregated instead of only the one that answered.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,30 +1,101 @@
 """
 Custom middleware for rate limiting, monitoring, and security
 """
+import asyncio
 import time
 from fastapi import Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from typing import Dict, Optional
 import hashlib
-from collections import defaultdict
+from collections import deque
+from cachetools import LRUCache, TTLCache
 from datetime import datetime, timedelta
+from secrets import token_hex
 import logging
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from metrics import REQUEST_LATENCY
 
 logger = logging.getLogger(__name__)
 
 
+# Atomic sliding-window check: drop expired hits, count, and record this one
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local win = tonumber(ARGV[2])
+local lim = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - win * 1000)
+local n = redis.call('ZCARD', key)
+if n >= lim then return {0, n} end
+redis.call('ZADD', key, now, now .. ':' .. ARGV[4])
+redis.call('PEXPIRE', key, win * 1000)
+return {1, n + 1}
+"""
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """
-    Token bucket rate limiting middleware
-    Limits requests per IP address
+    Sliding window rate limiting middleware
+    Limits requests per IP address, shared across workers through Redis
+    when configured, otherwise tracked in-process
     """
     
-    def __init__(self, app, requests_per_window: int = 100, window_seconds: int = 3600):
+    def __init__(
+        self,
+        app,
+        requests_per_window: int = 100,
+        window_seconds: int = 3600,
+        redis_url: Optional[str] = None,
+        max_tracked_ips: int = 10000
+    ):
         super().__init__(app)
         self.requests_per_window = requests_per_window
         self.window_seconds = window_seconds
-        self.request_counts: Dict[str, list] = defaultdict(list)
+        # Bounded so idle IPs age out instead of accumulating forever
+        self.request_counts: LRUCache = LRUCache(maxsize=max_tracked_ips)
+        self._redis = Redis.from_url(redis_url, decode_responses=False) if redis_url else None
+        self._script = self._redis.register_script(SLIDING_WINDOW_LUA) if self._redis else None
+        self._redis_ready: Optional[bool] = None
+    
+    async def _use_redis(self) -> bool:
+        """Ping Redis once; fall back to in-process counting if it's unreachable"""
+        if self._redis is None:
+            return False
+        if self._redis_ready is None:
+            try:
+                await self._redis.ping()
+                self._redis_ready = True
+            except RedisError as e:
+                logger.warning(f"Redis unavailable, using in-process rate limiting: {e}")
+                self._redis_ready = False
+        return self._redis_ready
+    
+    async def _check_redis(self, client_ip: str, current_time: float) -> tuple:
+        allowed, count = await self._script(
+            keys=[f"rl:{client_ip}"],
+            args=[int(current_time * 1000), self.window_seconds, self.requests_per_window, token_hex(8)]
+        )
+        return bool(allowed), int(count)
+    
+    def _check_local(self, client_ip: str, current_time: float) -> tuple:
+        bucket = self.request_counts.get(client_ip)
+        if bucket is None:
+            bucket = self.request_counts[client_ip] = deque()
+        
+        # Clean old requests (timestamps are in arrival order)
+        while bucket and current_time - bucket[0] >= self.window_seconds:
+            bucket.popleft()
+        
+        count = len(bucket)
+        if count >= self.requests_per_window:
+            return False, count
+        
+        # Add current request
+        bucket.append(current_time)
+        return True, count + 1
     
     async def dispatch(self, request: Request, call_next):
         # Get client IP
@@ -34,15 +105,18 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         if request.url.path in ["/", "/health", "/metrics"]:
             return await call_next(request)
         
-        # Clean old requests
         current_time = time.time()
-        self.request_counts[client_ip] = [
-            req_time for req_time in self.request_counts[client_ip]
-            if current_time - req_time < self.window_seconds
-        ]
+        if await self._use_redis():
+            try:
+                allowed, count = await self._check_redis(client_ip, current_time)
+            except RedisError as e:
+                logger.warning(f"Redis rate limit check failed: {e}")
+                allowed, count = self._check_local(client_ip, current_time)
+        else:
+            allowed, count = self._check_local(client_ip, current_time)
         
         # Check rate limit
-        if len(self.request_counts[client_ip]) >= self.requests_per_window:
+        if not allowed:
             logger.warning(f"Rate limit exceeded for IP: {client_ip}")
             return JSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -53,15 +127,10 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                 }
             )
         
-        # Add current request
-        self.request_counts[client_ip].append(current_time)
-        
         # Add rate limit headers
         response = await call_next(request)
         response.headers["X-RateLimit-Limit"] = str(self.requests_per_window)
-        response.headers["X-RateLimit-Remaining"] = str(
-            self.requests_per_window - len(self.request_counts[client_ip])
-        )
+        response.headers["X-RateLimit-Remaining"] = str(self.requests_per_window - count)
         response.headers["X-RateLimit-Reset"] = str(
             int(current_time + self.window_seconds)
         )
@@ -69,6 +138,12 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         return response
 
 
+def _route_path(request: Request) -> str:
+    """Route template (e.g. /items/{id}) so metric labels stay low-cardinality"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
     """Log all requests with timing information"""
     
@@ -91,6 +166,11 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
             
             # Calculate duration
             duration = time.time() - start_time
+            REQUEST_LATENCY.labels(
+                method=request.method,
+                path=_route_path(request),
+                status=response.status_code,
+            ).observe(duration)
             
             # Log response
             logger.info(
@@ -142,15 +222,16 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
 class CacheMiddleware(BaseHTTPMiddleware):
     """Simple in-memory caching for GET requests"""
     
-    def __init__(self, app, ttl: int = 300):
+    def __init__(self, app, ttl: int = 300, max_entries: int = 1024):
         super().__init__(app)
-        self.cache: Dict[str, tuple] = {}
+        self.cache: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
         self.ttl = ttl
+        self._locks: Dict[str, asyncio.Lock] = {}
     
     def _get_cache_key(self, request: Request) -> str:
         """Generate cache key from request"""
         key_string = f"{request.method}:{request.url.path}:{request.url.query}"
-        return hashlib.md5(key_string.encode()).hexdigest()
+        return hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest()
     
     async def dispatch(self, request: Request, call_next):
         # Only cache GET requests
@@ -163,22 +244,31 @@ class CacheMiddleware(BaseHTTPMiddleware):
         
         cache_key = self._get_cache_key(request)
         
-        # Check cache
-        if cache_key in self.cache:
-            cached_response, cached_time = self.cache[cache_key]
-            if time.time() - cached_time < self.ttl:
-                logger.debug(f"Cache hit for {request.url.path}")
-                return cached_response
-            else:
-                # Remove expired cache
-                del self.cache[cache_key]
+        # Check cache (TTLCache drops expired entries itself)
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            # Concurrent misses for the same key wait for a single upstream call
+            lock = self._locks.setdefault(cache_key, asyncio.Lock())
+            try:
+                async with lock:
+                    cached = self.cache.get(cache_key)
+                    if cached is None:
+                        response = await call_next(request)
+                        if response.status_code != 200:
+                            return response
+                        
+                        # The body stream can only be read once; keep the bytes
+                        body = b"".join([chunk async for chunk in response.body_iterator])
+                        self.cache[cache_key] = (response.status_code, dict(response.headers), body)
+                        return Response(
+                            content=body,
+                            status_code=response.status_code,
+                            headers={**response.headers, "X-Cache": "MISS"}
+                        )
+            finally:
+                if not lock.locked():
+                    self._locks.pop(cache_key, None)
         
-        # Process request
-        response = await call_next(request)
-        
-        # Cache successful responses
-        if response.status_code == 200:
-            self.cache[cache_key] = (response, time.time())
-            response.headers["X-Cache"] = "MISS"
-        
-        return response
+        logger.debug(f"Cache hit for {request.url.path}")
+        status_code, headers, body = cached
+        return Response(content=body, status_code=status_code, headers={**headers, "X-Cache": "HIT"})
@@ -1,10 +1,15 @@
 """
 Enhanced models with comprehensive validation
 """
-from pydantic import BaseModel, Field, field_validator, HttpUrl
+from pydantic import BaseModel, ConfigDict, Field, field_validator, HttpUrl
 from typing import Optional, List, Literal
 from datetime import datetime
 from enum import Enum
+import re
+
+
+# Characters rejected in topics, matched in a single pass
+_DANGEROUS_RE = re.compile(r"[<>\"';&|]")
 
 
 class DifficultyLevel(str, Enum):
@@ -41,21 +46,21 @@ class QuizGenerationRequest(BaseModel):
         v = v.strip()
         if not v:
             raise ValueError("Topic cannot be empty")
-        # Remove potentially harmful characters
-        dangerous_chars = ['<', '>', '"', "'", ';', '&', '|']
-        for char in dangerous_chars:
-            if char in v:
-                raise ValueError(f"Topic contains invalid character: {char}")
+        # Reject potentially harmful characters
+        match = _DANGEROUS_RE.search(v)
+        if match:
+            raise ValueError(f"Topic contains invalid character: {match.group(0)}")
         return v
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "topic": "Artificial Intelligence",
                 "num_questions": 10,
                 "difficulty": "medium"
             }
         }
+    )
 
 
 class QuizQuestion(BaseModel):
@@ -76,8 +81,8 @@ class QuizQuestion(BaseModel):
             raise ValueError("Correct answer must be one of the options")
         return v
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "question": "What is the capital of France?",
                 "options": ["London", "Berlin", "Paris", "Madrid"],
@@ -86,7 +91,22 @@ class QuizQuestion(BaseModel):
                 "difficulty": "easy",
                 "category": "Geography"
             }
-        }
+        },
+        frozen=True
+    )
+
+
+class GeneratedQuestion(BaseModel):
+    """Question shape requested from Gemini's JSON mode"""
+    question: str
+    options: List[str]
+    correct_answer: str
+    explanation: str
+
+
+class GeneratedQuiz(BaseModel):
+    """Response schema passed to Gemini as response_schema"""
+    questions: List[GeneratedQuestion]
 
 
 class QuizResponse(BaseModel):
@@ -99,8 +119,8 @@ class QuizResponse(BaseModel):
     quiz_id: Optional[str] = None
     estimated_duration_minutes: Optional[int] = None
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "topic": "Artificial Intelligence",
                 "questions": [
@@ -116,7 +136,9 @@ class QuizResponse(BaseModel):
                 "generated_at": "2025-11-08T12:00:00",
                 "estimated_duration_minutes": 15
             }
-        }
+        },
+        frozen=True
+    )
 
 
 class ErrorResponse(BaseModel):
@@ -127,8 +149,8 @@ class ErrorResponse(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     path: Optional[str] = Field(None, description="Request path that caused error")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "error": "ValidationError",
                 "message": "Invalid input data",
@@ -136,7 +158,9 @@ class ErrorResponse(BaseModel):
                 "timestamp": "2025-11-08T12:00:00",
                 "path": "/api/v1/generate-quiz"
             }
-        }
+        },
+        frozen=True
+    )
 
 
 class HealthCheck(BaseModel):
@@ -147,8 +171,8 @@ class HealthCheck(BaseModel):
     checks: dict[str, bool]
     uptime_seconds: Optional[float] = None
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "status": "healthy",
                 "version": "2.0.0",
@@ -160,7 +184,9 @@ class HealthCheck(BaseModel):
                 },
                 "uptime_seconds": 3600.5
             }
-        }
+        },
+        frozen=True
+    )
 
 
 class QuizSubmission(BaseModel):
@@ -190,8 +216,8 @@ class QuizResult(BaseModel):
     feedback: str
     details: List[dict]
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "quiz_id": "quiz_12345",
                 "total_questions": 10,
@@ -203,4 +229,6 @@ class QuizResult(BaseModel):
                 "feedback": "Good job! You have a solid understanding of the topic.",
                 "details": []
             }
-        }
+        },
+        frozen=True
+    )
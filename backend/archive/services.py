@@ -2,21 +2,79 @@
 Enhanced services with retry logic, circuit breakers, and comprehensive error handling
 """
 import google.generativeai as genai
-import requests
-from bs4 import BeautifulSoup
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 from typing import Optional, List, Dict
+import asyncio
+import hashlib
+import inspect
+import itertools
 import logging
+import math
 import time
-import json
 import re
+import zlib
+import orjson
 from functools import wraps
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from urllib.parse import quote
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from config import settings
-from models import QuizQuestion, DifficultyLevel
+from metrics import AI_LATENCY, CIRCUIT_BREAKER_STATE, CIRCUIT_STATES, WIKI_LATENCY
+from models import QuizQuestion, DifficultyLevel, GeneratedQuiz
 
 logger = logging.getLogger(__name__)
 
+QUESTIONS_PER_CALL = 10  # Larger quizzes are split into parallel Gemini calls
+
+_DIFFICULTY_INSTRUCTIONS = {
+    DifficultyLevel.EASY: "basic facts, definitions, and simple concepts that can be understood by beginners",
+    DifficultyLevel.MEDIUM: "moderate understanding requiring some analysis and connection of concepts",
+    DifficultyLevel.HARD: "deep understanding, critical thinking, complex analysis, and expert-level knowledge"
+}
+
+_PROMPT_TEMPLATE = """You are an expert quiz generator. Create {num_questions} high-quality multiple-choice questions about {topic}.
+
+CONTENT TO USE:
+{content}
+
+REQUIREMENTS:
+1. Generate EXACTLY {num_questions} questions
+2. Difficulty: {difficulty} - Focus on {difficulty_instructions}
+3. Each question must have:
+   - A clear, specific question
+   - Exactly 4 answer options (A, B, C, D)
+   - Only ONE correct answer
+   - An optional brief explanation (1-2 sentences)
+   - The correct answer copied exactly from the options
+
+4. Questions should:
+   - Be based solely on the provided content
+   - Test different aspects of the topic
+   - Avoid trick questions or ambiguity
+   - Have plausible wrong answers (distractors)
+{split_note}
+Generate the quiz now:"""
+
+# One template per difficulty with the static instructions already filled in;
+# the per-request fields are formatted back in as placeholders
+_PROMPT_TEMPLATES = {
+    level: _PROMPT_TEMPLATE.format(
+        difficulty=level.value,
+        difficulty_instructions=instructions,
+        num_questions="{num_questions}",
+        topic="{topic}",
+        content="{content}",
+        split_note="{split_note}"
+    )
+    for level, instructions in _DIFFICULTY_INSTRUCTIONS.items()
+}
+
+_CITATION_RE = re.compile(r'\[\d+\]')
+_WS_RE = re.compile(r'\s+')
+
 
 class ServiceException(Exception):
     """Base exception for service errors"""
@@ -36,63 +94,131 @@ class AIServiceException(ServiceException):
 class CircuitBreaker:
     """Simple circuit breaker pattern implementation"""
     
-    def __init__(self, failure_threshold: int = 5, timeout: int = 60):
+    def __init__(self, failure_threshold: int = 5, timeout: int = 60, name: str = "default"):
+        self.name = name
         self.failure_threshold = failure_threshold
         self.timeout = timeout
         self.failure_count = 0
         self.last_failure_time: Optional[float] = None
         self.state = "closed"  # closed, open, half-open
     
+    @property
+    def state(self) -> str:
+        return self._state
+    
+    @state.setter
+    def state(self, value: str):
+        self._state = value
+        CIRCUIT_BREAKER_STATE.labels(breaker=self.name).set(CIRCUIT_STATES[value])
+    
+    def _before_call(self):
+        if self.state == "open":
+            if time.time() - self.last_failure_time < self.timeout:
+                raise ServiceException("Circuit breaker is OPEN")
+            else:
+                self.state = "half-open"
+    
+    def _on_success(self):
+        if self.state == "half-open":
+            self.state = "closed"
+            self.failure_count = 0
+    
+    def _on_failure(self):
+        self.failure_count += 1
+        self.last_failure_time = time.time()
+        
+        if self.failure_count >= self.failure_threshold:
+            self.state = "open"
+            logger.error(f"Circuit breaker OPENED after {self.failure_count} failures")
+    
     def call(self, func):
+        # Coroutines need an async wrapper, otherwise failures surface only
+        # after the wrapper has already returned the un-awaited coroutine
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                self._before_call()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    self._on_failure()
+                    raise
+                self._on_success()
+                return result
+            
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if self.state == "open":
-                if time.time() - self.last_failure_time < self.timeout:
-                    raise ServiceException("Circuit breaker is OPEN")
-                else:
-                    self.state = "half-open"
-            
+            self._before_call()
             try:
                 result = func(*args, **kwargs)
-                if self.state == "half-open":
-                    self.state = "closed"
-                    self.failure_count = 0
-                return result
-            except Exception as e:
-                self.failure_count += 1
-                self.last_failure_time = time.time()
-                
-                if self.failure_count >= self.failure_threshold:
-                    self.state = "open"
-                    logger.error(f"Circuit breaker OPENED after {self.failure_count} failures")
-                
+            except Exception:
+                self._on_failure()
                 raise
+            self._on_success()
+            return result
         
         return wrapper
 
 
 # Initialize circuit breakers
-wikipedia_circuit_breaker = CircuitBreaker(failure_threshold=5, timeout=60)
-ai_circuit_breaker = CircuitBreaker(failure_threshold=3, timeout=120)
+wikipedia_circuit_breaker = CircuitBreaker(failure_threshold=5, timeout=60, name="wikipedia")
+ai_circuit_breaker = CircuitBreaker(failure_threshold=3, timeout=120, name="ai")
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """HTTP/2 client with a shared connection pool for Wikipedia requests"""
+    return httpx.AsyncClient(
+        http2=True,
+        headers={'User-Agent': settings.wikipedia_user_agent},
+        timeout=settings.wikipedia_timeout,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=50,
+            keepalive_expiry=30
+        )
+    )
 
 
 class WikipediaService:
     """Enhanced Wikipedia scraping service with retry logic"""
     
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': settings.wikipedia_user_agent
-        })
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, cache: Optional[Redis] = None):
         self.timeout = settings.wikipedia_timeout
+        self._http = client
+        self._cache = cache
+    
+    def use_client(self, client: httpx.AsyncClient):
+        """Use a client shared with the rest of the app (owned by the caller)"""
+        self._http = client
+    
+    def use_cache(self, cache: Redis):
+        """Cache article text in Redis, shared by every worker"""
+        self._cache = cache
+    
+    @property
+    def _client(self) -> httpx.AsyncClient:
+        """Pooled keep-alive client, created on first use and reused across requests"""
+        if self._http is None or self._http.is_closed:
+            self._http = create_http_client()
+        return self._http
+    
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((requests.RequestException, WikipediaException))
+        retry=retry_if_exception_type((httpx.HTTPError, WikipediaException)),
+        reraise=True
     )
     @wikipedia_circuit_breaker.call
-    def scrape_article(self, topic: str) -> str:
+    async def scrape_article(self, topic: str) -> str:
         """
         Scrape Wikipedia article with retry logic and circuit breaker
         
@@ -112,35 +238,33 @@ class WikipediaService:
             if topic.startswith('http'):
                 url = topic
             else:
-                # Clean topic and create URL
-                clean_topic = topic.strip().replace(' ', '_')
-                url = f"https://en.wikipedia.org/wiki/{clean_topic}"
+                # Clean topic and create URL (percent-encodes non-ASCII titles)
+                url = f"https://en.wikipedia.org/wiki/{quote(topic.strip().replace(' ', '_'))}"
             
             logger.debug(f"Fetching URL: {url}")
             
             # Make request
-            response = self.session.get(url, timeout=self.timeout)
+            with WIKI_LATENCY.time():
+                response = await self._client.get(url)
             response.raise_for_status()
             
-            # Parse HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove unwanted elements
-            for element in soup.find_all(['script', 'style', 'nav', 'footer', 'header']):
-                element.decompose()
-            
-            # Get main content
-            content = soup.find('div', {'id': 'mw-content-text'})
+            # Parse HTML and jump straight to the article body
+            tree = LexborHTMLParser(response.content)
+            content = tree.css_first('div#mw-content-text')
             if not content:
                 raise WikipediaException("Could not find article content")
             
+            # Inline TemplateStyles/scripts can sit inside paragraphs
+            for element in content.css('script, style'):
+                element.decompose()
+            
             # Extract paragraphs
-            paragraphs = content.find_all('p')
-            text = '\n\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+            paragraphs = (p.text().strip() for p in content.css('p'))
+            text = '\n\n'.join(p for p in paragraphs if p)
             
             # Clean text
-            text = re.sub(r'\[\d+\]', '', text)  # Remove citation numbers
-            text = re.sub(r'\s+', ' ', text)     # Normalize whitespace
+            text = _CITATION_RE.sub('', text)  # Remove citation numbers
+            text = _WS_RE.sub(' ', text)       # Normalize whitespace
             text = text.strip()
             
             if len(text) < 100:
@@ -149,22 +273,44 @@ class WikipediaService:
             logger.info(f"Successfully scraped {len(text)} characters")
             return text
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Wikipedia request failed: {e}")
             raise WikipediaException(f"Failed to fetch Wikipedia article: {str(e)}")
         except Exception as e:
             logger.error(f"Wikipedia scraping error: {e}")
             raise WikipediaException(f"Error processing Wikipedia content: {str(e)}")
     
-    def get_article_summary(self, topic: str, max_length: int = 2000) -> str:
+    async def get_article_summary(self, topic: str, max_length: int = 2000) -> str:
         """Get a summary of the article for AI processing"""
-        full_text = self.scrape_article(topic)
+        cache_key = (
+            "wiki:" + hashlib.blake2b(topic.strip().encode(), digest_size=16).hexdigest()
+            + f":{max_length}"
+        )
+        if self._cache is not None:
+            try:
+                cached = await self._cache.get(cache_key)
+                if cached:
+                    return zlib.decompress(cached).decode()
+            except RedisError as e:
+                logger.warning(f"Article cache lookup failed: {e}")
+        
+        full_text = await self.scrape_article(topic)
         
         # Limit text length to avoid AI token limits
         if len(full_text) > max_length:
             # Try to split at sentence boundaries
             sentences = full_text[:max_length].split('. ')
-            return '. '.join(sentences[:-1]) + '.'
+            full_text = '. '.join(sentences[:-1]) + '.'
+        
+        if self._cache is not None:
+            try:
+                await self._cache.set(
+                    cache_key,
+                    zlib.compress(full_text.encode()),
+                    ex=settings.wikipedia_cache_ttl
+                )
+            except RedisError as e:
+                logger.warning(f"Article cache store failed: {e}")
         
         return full_text
 
@@ -178,15 +324,14 @@ class AIService:
         self.generation_config = {
             "temperature": settings.ai_temperature,
             "max_output_tokens": settings.ai_max_tokens,
+            # JSON mode: Gemini returns bare JSON matching the schema
+            "response_mime_type": "application/json",
+            "response_schema": GeneratedQuiz,
         }
+        # Caps in-flight Gemini calls to stay within the RPM quota
+        self._sem = asyncio.Semaphore(settings.ai_max_concurrency)
     
-    @retry(
-        stop=stop_after_attempt(2),
-        wait=wait_exponential(multiplier=1, min=4, max=20),
-        retry=retry_if_exception_type(AIServiceException)
-    )
-    @ai_circuit_breaker.call
-    def generate_quiz(
+    async def generate_quiz(
         self,
         content: str,
         num_questions: int,
@@ -196,6 +341,9 @@ class AIService:
         """
         Generate quiz questions using AI with enhanced error handling
         
+        Up to QUESTIONS_PER_CALL questions are requested in a single call;
+        larger quizzes are split into parallel calls and de-duplicated.
+        
         Args:
             content: Wikipedia article content
             num_questions: Number of questions to generate
@@ -210,28 +358,69 @@ class AIService:
         """
         logger.info(f"Generating {num_questions} {difficulty} questions about {topic}")
         
+        if num_questions <= QUESTIONS_PER_CALL:
+            questions = await self._generate_chunk(content, num_questions, difficulty, topic)
+        else:
+            parts = math.ceil(num_questions / QUESTIONS_PER_CALL)
+            sizes = [
+                num_questions // parts + (1 if i < num_questions % parts else 0)
+                for i in range(parts)
+            ]
+            results = await asyncio.gather(*[
+                self._generate_chunk(content, size, difficulty, topic, part=i + 1, parts=parts)
+                for i, size in enumerate(sizes)
+            ])
+            
+            # Parallel calls can overlap; keep the first copy of each question
+            seen = set()
+            questions = []
+            for question in itertools.chain.from_iterable(results):
+                key = question.question.strip().lower()
+                if key not in seen:
+                    seen.add(key)
+                    questions.append(question)
+        
+        # Validate we got enough questions
+        if len(questions) < num_questions * 0.8:  # Allow 20% tolerance
+            logger.warning(f"Only generated {len(questions)} of {num_questions} requested questions")
+        
+        return questions[:num_questions]
+    
+    @retry(
+        stop=stop_after_attempt(2),
+        wait=wait_exponential(multiplier=1, min=4, max=20),
+        retry=retry_if_exception_type(AIServiceException),
+        reraise=True
+    )
+    @ai_circuit_breaker.call
+    async def _generate_chunk(
+        self,
+        content: str,
+        num_questions: int,
+        difficulty: DifficultyLevel,
+        topic: str,
+        part: int = 1,
+        parts: int = 1
+    ) -> List[QuizQuestion]:
+        """Generate one set of questions with a single Gemini call"""
         try:
             # Create enhanced prompt
-            prompt = self._create_prompt(content, num_questions, difficulty, topic)
+            prompt = self._create_prompt(content, num_questions, difficulty, topic, part, parts)
             
             # Generate content
             start_time = time.time()
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
-            )
+            async with self._sem:
+                response = await self.model.generate_content_async(
+                    prompt,
+                    generation_config=self.generation_config
+                )
             duration = time.time() - start_time
+            AI_LATENCY.observe(duration)
             
             logger.info(f"AI generation completed in {duration:.2f}s")
             
             # Parse response
-            questions = self._parse_response(response.text, difficulty)
-            
-            # Validate we got enough questions
-            if len(questions) < num_questions * 0.8:  # Allow 20% tolerance
-                logger.warning(f"Only generated {len(questions)} of {num_questions} requested questions")
-            
-            return questions[:num_questions]
+            return self._parse_response(response.text, difficulty)
             
         except Exception as e:
             logger.error(f"AI generation failed: {e}")
@@ -242,71 +431,29 @@ class AIService:
         content: str,
         num_questions: int,
         difficulty: DifficultyLevel,
-        topic: str
+        topic: str,
+        part: int = 1,
+        parts: int = 1
     ) -> str:
         """Create an optimized prompt for quiz generation"""
+        split_note = (
+            f"5. This is question set {part} of {parts}: cover different parts of the content than the other sets\n"
+            if parts > 1 else ""
+        )
         
-        difficulty_instructions = {
-            DifficultyLevel.EASY: "basic facts, definitions, and simple concepts that can be understood by beginners",
-            DifficultyLevel.MEDIUM: "moderate understanding requiring some analysis and connection of concepts",
-            DifficultyLevel.HARD: "deep understanding, critical thinking, complex analysis, and expert-level knowledge"
-        }
-        
-        prompt = f"""You are an expert quiz generator. Create {num_questions} high-quality multiple-choice questions about {topic}.
-
-CONTENT TO USE:
-{content[:3000]}
-
-REQUIREMENTS:
-1. Generate EXACTLY {num_questions} questions
-2. Difficulty: {difficulty.value} - Focus on {difficulty_instructions[difficulty]}
-3. Each question must have:
-   - A clear, specific question
-   - Exactly 4 answer options (A, B, C, D)
-   - Only ONE correct answer
-   - An optional brief explanation (1-2 sentences)
-
-4. Questions should:
-   - Be based solely on the provided content
-   - Test different aspects of the topic
-   - Avoid trick questions or ambiguity
-   - Have plausible wrong answers (distractors)
-
-OUTPUT FORMAT (JSON):
-{{
-  "questions": [
-    {{
-      "question": "Question text here?",
-      "options": ["Option A", "Option B", "Option C", "Option D"],
-      "correct_answer": "Option A",
-      "explanation": "Brief explanation why Option A is correct"
-    }}
-  ]
-}}
-
-Generate the quiz now:"""
-        
-        return prompt
+        # content is already bounded by get_article_summary(max_length=...)
+        return _PROMPT_TEMPLATES[difficulty].format(
+            num_questions=num_questions,
+            topic=topic,
+            content=content,
+            split_note=split_note
+        )
     
     def _parse_response(self, response_text: str, difficulty: DifficultyLevel) -> List[QuizQuestion]:
         """Parse AI response into QuizQuestion objects"""
         
         try:
-            # Try to extract JSON from response
-            # Sometimes AI wraps JSON in markdown code blocks
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            if json_match:
-                json_text = json_match.group(1)
-            else:
-                # Try to find JSON object directly
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    json_text = json_match.group(0)
-                else:
-                    json_text = response_text
-            
-            # Parse JSON
-            data = json.loads(json_text)
+            data = orjson.loads(response_text)
             
             # Extract questions
             questions_data = data.get('questions', [])
@@ -328,7 +475,7 @@ Generate the quiz now:"""
             
             return questions
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {e}")
             logger.debug(f"Response text: {response_text[:500]}")
             raise AIServiceException("AI response was not valid JSON")
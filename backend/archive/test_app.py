@@ -2,26 +2,43 @@
 Comprehensive test suite for Wiki Quiz Generator
 """
 import pytest
+import httpx
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 import sys
 import os
 
 # Add backend to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from main_enhanced import app
 from models import QuizGenerationRequest, DifficultyLevel, QuizQuestion
-from services import WikipediaService, AIService, WikipediaException, AIServiceException
+from services import (
+    CircuitBreaker,
+    WikipediaService,
+    AIService,
+    WikipediaException,
+    AIServiceException,
+    ServiceException,
+)
 
 
-client = TestClient(app)
+@pytest.fixture(scope="module")
+def wiki_service():
+    """WikipediaService shared by the module; tests plug in their own transport"""
+    return WikipediaService()
+
+
+@pytest.fixture(scope="module")
+def ai_service():
+    """AIService built once, without configuring the real Gemini client"""
+    with patch('google.generativeai.configure'):
+        return AIService()
 
 
 class TestHealthEndpoints:
     """Test health check endpoints"""
     
-    def test_root_endpoint(self):
+    def test_root_endpoint(self, client):
         """Test root endpoint returns basic info"""
         response = client.get("/")
         assert response.status_code == 200
@@ -30,7 +47,7 @@ class TestHealthEndpoints:
         assert "version" in data
         assert "status" in data
     
-    def test_health_endpoint(self):
+    def test_health_endpoint(self, client):
         """Test detailed health check"""
         response = client.get("/health")
         assert response.status_code == 200
@@ -44,7 +61,7 @@ class TestHealthEndpoints:
 class TestQuizGeneration:
     """Test quiz generation endpoint"""
     
-    def test_generate_quiz_valid_request(self):
+    def test_generate_quiz_valid_request(self, client, wiki_mock, ai_mock):
         """Test quiz generation with valid request"""
         request_data = {
             "topic": "Python Programming",
@@ -52,29 +69,26 @@ class TestQuizGeneration:
             "difficulty": "medium"
         }
         
-        with patch('services.wikipedia_service.get_article_summary') as mock_wiki, \
-             patch('services.ai_service.generate_quiz') as mock_ai:
-            
-            # Mock responses
-            mock_wiki.return_value = "Python is a programming language..."
-            mock_ai.return_value = [
-                QuizQuestion(
-                    question="What is Python?",
-                    options=["A snake", "A language", "A tool", "A framework"],
-                    correct_answer="A language",
-                    difficulty=DifficultyLevel.MEDIUM
-                )
-            ] * 5
-            
-            response = client.post("/generate-quiz", json=request_data)
-            assert response.status_code == 200
-            data = response.json()
-            assert data["topic"] == "Python Programming"
-            assert data["total_questions"] == 5
-            assert "quiz_id" in data
-            assert len(data["questions"]) == 5
+        # Mock responses
+        wiki_mock.return_value = "Python is a programming language..."
+        ai_mock.return_value = [
+            QuizQuestion(
+                question="What is Python?",
+                options=["A snake", "A language", "A tool", "A framework"],
+                correct_answer="A language",
+                difficulty=DifficultyLevel.MEDIUM
+            )
+        ] * 5
+        
+        response = client.post("/generate-quiz", json=request_data)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["topic"] == "Python Programming"
+        assert data["total_questions"] == 5
+        assert "quiz_id" in data
+        assert len(data["questions"]) == 5
     
-    def test_generate_quiz_invalid_num_questions(self):
+    def test_generate_quiz_invalid_num_questions(self, client):
         """Test quiz generation with invalid number of questions"""
         request_data = {
             "topic": "Python Programming",
@@ -85,7 +99,7 @@ class TestQuizGeneration:
         response = client.post("/generate-quiz", json=request_data)
         assert response.status_code == 422  # Validation error
     
-    def test_generate_quiz_invalid_difficulty(self):
+    def test_generate_quiz_invalid_difficulty(self, client):
         """Test quiz generation with invalid difficulty"""
         request_data = {
             "topic": "Python Programming",
@@ -96,7 +110,7 @@ class TestQuizGeneration:
         response = client.post("/generate-quiz", json=request_data)
         assert response.status_code == 422  # Validation error
     
-    def test_generate_quiz_empty_topic(self):
+    def test_generate_quiz_empty_topic(self, client):
         """Test quiz generation with empty topic"""
         request_data = {
             "topic": "",
@@ -107,7 +121,7 @@ class TestQuizGeneration:
         response = client.post("/generate-quiz", json=request_data)
         assert response.status_code == 422  # Validation error
     
-    def test_generate_quiz_wikipedia_error(self):
+    def test_generate_quiz_wikipedia_error(self, client, wiki_mock):
         """Test handling of Wikipedia errors"""
         request_data = {
             "topic": "NonexistentTopic123456",
@@ -115,15 +129,14 @@ class TestQuizGeneration:
             "difficulty": "medium"
         }
         
-        with patch('services.wikipedia_service.get_article_summary') as mock_wiki:
-            mock_wiki.side_effect = WikipediaException("Article not found")
-            
-            response = client.post("/generate-quiz", json=request_data)
-            assert response.status_code == 503
-            data = response.json()
-            assert "detail" in data
+        wiki_mock.side_effect = WikipediaException("Article not found")
+        
+        response = client.post("/generate-quiz", json=request_data)
+        assert response.status_code == 503
+        data = response.json()
+        assert "detail" in data
     
-    def test_generate_quiz_ai_error(self):
+    def test_generate_quiz_ai_error(self, client, wiki_mock, ai_mock):
         """Test handling of AI service errors"""
         request_data = {
             "topic": "Python Programming",
@@ -131,20 +144,17 @@ class TestQuizGeneration:
             "difficulty": "medium"
         }
         
-        with patch('services.wikipedia_service.get_article_summary') as mock_wiki, \
-             patch('services.ai_service.generate_quiz') as mock_ai:
-            
-            mock_wiki.return_value = "Python is a programming language..."
-            mock_ai.side_effect = AIServiceException("AI service unavailable")
-            
-            response = client.post("/generate-quiz", json=request_data)
-            assert response.status_code == 503
+        wiki_mock.return_value = "Python is a programming language..."
+        ai_mock.side_effect = AIServiceException("AI service unavailable")
+        
+        response = client.post("/generate-quiz", json=request_data)
+        assert response.status_code == 503
 
 
 class TestRateLimiting:
     """Test rate limiting middleware"""
     
-    def test_rate_limit_not_exceeded(self):
+    def test_rate_limit_not_exceeded(self, client):
         """Test requests within rate limit"""
         for _ in range(5):
             response = client.get("/")
@@ -153,6 +163,44 @@ class TestRateLimiting:
             assert "X-RateLimit-Remaining" in response.headers
 
 
+class TestCacheMiddleware:
+    """Test response caching middleware"""
+    
+    def test_cache_hit_returns_full_body(self):
+        """Test cached responses are replayed with their body intact"""
+        from fastapi import FastAPI
+        from middleware import CacheMiddleware
+        
+        calls = []
+        cache_app = FastAPI()
+        
+        @cache_app.get("/items")
+        async def items():
+            calls.append(1)
+            return {"items": [1, 2, 3]}
+        
+        cache_app.add_middleware(CacheMiddleware, ttl=60)
+        cache_client = TestClient(cache_app)
+        
+        first = cache_client.get("/items")
+        second = cache_client.get("/items")
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.json() == {"items": [1, 2, 3]}
+        assert len(calls) == 1
+
+
+class TestCompression:
+    """Test response compression"""
+    
+    def test_small_response_not_compressed(self, client):
+        """Test responses under the GZip minimum size are sent uncompressed"""
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert len(response.content) < 512
+        assert "content-encoding" not in response.headers
+
+
 class TestModels:
     """Test Pydantic models"""
     
@@ -197,86 +245,105 @@ class TestModels:
 class TestWikipediaService:
     """Test Wikipedia scraping service"""
     
-    def test_scrape_article_success(self):
+    @pytest.mark.asyncio
+    async def test_scrape_article_success(self, wiki_service, monkeypatch):
         """Test successful article scraping"""
-        service = WikipediaService()
-        
-        with patch('requests.Session.get') as mock_get:
-            mock_response = Mock()
-            mock_response.status_code = 200
-            mock_response.text = """
+        def handler(request):
+            return httpx.Response(200, text="""
                 <html>
                     <div id="mw-content-text">
-                        <p>Python is a programming language.</p>
-                        <p>It was created by Guido van Rossum.</p>
+                        <p>Python is a high-level, general-purpose programming language.</p>
+                        <p>It was created by Guido van Rossum and first released in 1991.</p>
                     </div>
                 </html>
-            """
-            mock_get.return_value = mock_response
-            
-            content = service.scrape_article("Python")
-            assert len(content) > 0
-            assert "Python" in content or "programming" in content.lower()
+            """)
+        
+        monkeypatch.setattr(wiki_service, '_http', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        
+        content = await wiki_service.scrape_article("Python")
+        assert len(content) > 0
+        assert "Python" in content or "programming" in content.lower()
+        await wiki_service.aclose()
     
-    def test_scrape_article_not_found(self):
+    @pytest.mark.asyncio
+    async def test_scrape_article_not_found(self, wiki_service, monkeypatch):
         """Test handling of missing articles"""
-        service = WikipediaService()
+        def handler(request):
+            return httpx.Response(404, text="Not Found")
         
-        with patch('requests.Session.get') as mock_get:
-            mock_response = Mock()
-            mock_response.status_code = 404
-            mock_response.raise_for_status.side_effect = Exception("404 Not Found")
-            mock_get.return_value = mock_response
-            
+        monkeypatch.setattr(wiki_service, '_http', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        
+        with pytest.raises(WikipediaException):
+            await wiki_service.scrape_article("NonexistentArticle12345")
+        await wiki_service.aclose()
+
+
+class TestCircuitBreaker:
+    """Test circuit breaker"""
+    
+    @pytest.mark.asyncio
+    async def test_opens_on_async_failures(self):
+        """Test failures raised by awaited coroutines trip the breaker"""
+        breaker = CircuitBreaker(failure_threshold=2, timeout=60)
+        
+        @breaker.call
+        async def flaky():
+            raise WikipediaException("boom")
+        
+        for _ in range(2):
             with pytest.raises(WikipediaException):
-                service.scrape_article("NonexistentArticle12345")
+                await flaky()
+        
+        assert breaker.state == "open"
+        with pytest.raises(ServiceException, match="OPEN"):
+            await flaky()
 
 
 class TestAIService:
     """Test AI service"""
     
-    def test_generate_quiz_success(self):
+    @pytest.mark.asyncio
+    async def test_generate_quiz_success(self, ai_service, monkeypatch):
         """Test successful quiz generation"""
-        service = AIService()
+        mock_response = Mock()
+        mock_response.text = """
+        {
+            "questions": [
+                {
+                    "question": "What is Python?",
+                    "options": ["A snake", "A language", "A tool", "A framework"],
+                    "correct_answer": "A language",
+                    "explanation": "Python is a programming language"
+                }
+            ]
+        }
+        """
+        monkeypatch.setattr(
+            ai_service.model, 'generate_content_async', AsyncMock(return_value=mock_response)
+        )
         
-        with patch.object(service.model, 'generate_content') as mock_generate:
-            mock_response = Mock()
-            mock_response.text = """
-            {
-                "questions": [
-                    {
-                        "question": "What is Python?",
-                        "options": ["A snake", "A language", "A tool", "A framework"],
-                        "correct_answer": "A language",
-                        "explanation": "Python is a programming language"
-                    }
-                ]
-            }
-            """
-            mock_generate.return_value = mock_response
-            
-            questions = service.generate_quiz(
-                content="Python is a programming language",
-                num_questions=1,
-                difficulty=DifficultyLevel.MEDIUM,
-                topic="Python"
-            )
-            
-            assert len(questions) >= 1
-            assert isinstance(questions[0], QuizQuestion)
+        questions = await ai_service.generate_quiz(
+            content="Python is a programming language",
+            num_questions=1,
+            difficulty=DifficultyLevel.MEDIUM,
+            topic="Python"
+        )
+        
+        assert len(questions) >= 1
+        assert isinstance(questions[0], QuizQuestion)
 
 
 class TestSecurity:
     """Test security features"""
     
-    def test_security_headers_present(self):
+    def test_security_headers_present(self, client):
         """Test that security headers are added"""
         response = client.get("/")
         assert "X-Content-Type-Options" in response.headers
         assert "X-Frame-Options" in response.headers
         assert response.headers["X-Content-Type-Options"] == "nosniff"
     
-    def test_cors_headers_present(self):
+    def test_cors_headers_present(self, client):
         """Test CORS headers are present"""
         response = client.get("/")
         assert "Access-Control-Allow-Origin" in response.headers
@@ -285,12 +352,12 @@ class TestSecurity:
 class TestErrorHandling:
     """Test error handling"""
     
-    def test_404_error(self):
+    def test_404_error(self, client):
         """Test 404 for non-existent endpoints"""
         response = client.get("/nonexistent")
         assert response.status_code == 404
     
-    def test_validation_error_format(self):
+    def test_validation_error_format(self, client):
         """Test validation error response format"""
         response = client.post("/generate-quiz", json={})
         assert response.status_code == 422
@@ -26,6 +26,15 @@ class Settings(BaseSettings):
     ai_temperature: float = 0.7
     ai_max_tokens: int = 2048
     ai_timeout: int = 30
+    ai_max_concurrency: int = 8  # Max in-flight Gemini calls per worker
+    ai_prompt_content_tokens: int = 1250  # Article tokens sent per quiz prompt
+    ai_streaming_enabled: bool = True  # Parse quiz questions as the response streams in
+    ai_batching_enabled: bool = False  # Coalesce concurrent requests into one Gemini call
+    ai_batch_window_ms: int = 50
+    ai_batch_max_size: int = 5
+    prompt_compression_enabled: bool = False  # requires llmlingua
+    prompt_compression_model: str = "microsoft/llmlingua-2-xlm-roberta-large-meetingbank"
+    prompt_compression_rate: float = 0.33
     
     # Rate Limiting
     rate_limit_enabled: bool = True
@@ -36,6 +45,13 @@ class Settings(BaseSettings):
     redis_enabled: bool = False
     redis_url: Optional[str] = None
     cache_ttl: int = 3600  # 1 hour
+    llm_cache_max_entries: int = 512
+    semantic_cache_enabled: bool = False  # requires sentence-transformers
+    semantic_cache_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_max_entries: int = 2048
+    semantic_cache_path: Optional[str] = None  # directory for persisted embeddings
+    semantic_cache_save_every: int = 32  # new entries between writes to semantic_cache_path
     
     # Database
     database_url: Optional[str] = None
@@ -56,6 +72,8 @@ class Settings(BaseSettings):
     wikipedia_timeout: int = 10
     wikipedia_retries: int = 3
     wikipedia_user_agent: str = "WikiQuizBot/2.0 (Educational Purpose)"
+    wikipedia_cache_ttl: int = 86400  # 1 day
+    wikipedia_cache_max_entries: int = 128
     
     # Quiz Configuration
     max_questions_per_quiz: int = 20
@@ -7,15 +7,26 @@ from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
 from config import settings
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
+
+def _json_serializer(value) -> str:
+    """Serialize JSON columns with orjson; int keys (attempt answers) become strings"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 # Create database engine
 if settings.database_url:
     engine = create_engine(
         settings.database_url,
         pool_size=settings.db_pool_size,
         max_overflow=settings.db_max_overflow,
+        pool_pre_ping=True,  # Replace connections dropped by idle timeouts/proxies
+        pool_recycle=1800,
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads,
         echo=settings.debug,
     )
 else:
@@ -23,12 +34,15 @@ else:
     engine = create_engine(
         "sqlite:///./wiki_quiz.db",
         connect_args={"check_same_thread": False},
+        json_serializer=_json_serializer,
+        json_deserializer=orjson.loads,
         echo=settings.debug,
     )
     logger.warning("Using SQLite database. Set DATABASE_URL for PostgreSQL in production.")
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create session factory; objects stay loaded after commit so responses
+# built from them don't trigger a refresh SELECT per attribute access
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Base class for models
 Base = declarative_base()
@@ -51,4 +65,8 @@ def init_db():
     """
     logger.info("Initializing database...")
     Base.metadata.create_all(bind=engine)
+    # create_all() skips tables that already exist, so add any newer indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     logger.info("Database initialized successfully")
@@ -1,11 +1,15 @@
 """
 SQLAlchemy database models
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Float, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from database import Base
 
+# Binary jsonb on PostgreSQL, plain JSON elsewhere (SQLite)
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class WikiArticle(Base):
     """Model for storing Wikipedia articles and their metadata"""
@@ -15,13 +19,14 @@ class WikiArticle(Base):
     url = Column(String(500), unique=True, nullable=False, index=True)
     title = Column(String(500), nullable=False)
     summary = Column(Text)
-    content = Column(Text)  # Full article text
-    raw_html = Column(Text)  # Raw HTML for reference
+    # Large text columns are deferred; load them with undefer() where needed
+    content = deferred(Column(Text))  # Full article text
+    raw_html = deferred(Column(Text))  # Raw HTML for reference
     
     # Extracted entities
-    key_entities = Column(JSON)  # {"people": [], "organizations": [], "locations": []}
-    sections = Column(JSON)  # List of section titles
-    related_topics = Column(JSON)  # List of related Wikipedia topics
+    key_entities = Column(JSONType)  # {"people": [], "organizations": [], "locations": []}
+    sections = Column(JSONType)  # List of section titles
+    related_topics = Column(JSONType)  # List of related Wikipedia topics
     
     # Metadata
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -44,16 +49,26 @@ class Quiz(Base):
     
     # Quiz metadata
     total_questions = Column(Integer)
-    difficulty_distribution = Column(JSON)  # {"easy": 2, "medium": 5, "hard": 3}
+    difficulty_distribution = Column(JSONType)  # {"easy": 2, "medium": 5, "hard": 3}
     
     # Generation metadata
     created_at = Column(DateTime, default=datetime.utcnow)
     generation_time_seconds = Column(Float)
     llm_model = Column(String(100))
     
+    # Newest-first index for history listing
+    __table_args__ = (
+        Index("ix_quizzes_created_at_desc", created_at.desc(), id),
+    )
+    
     # Relationships
     article = relationship("WikiArticle", back_populates="quizzes")
-    questions = relationship("QuizQuestion", back_populates="quiz", cascade="all, delete-orphan")
+    questions = relationship(
+        "QuizQuestion",
+        back_populates="quiz",
+        order_by="QuizQuestion.question_number",
+        cascade="all, delete-orphan"
+    )
     attempts = relationship("QuizAttempt", back_populates="quiz", cascade="all, delete-orphan")
     
     def __repr__(self):
@@ -97,7 +112,7 @@ class QuizAttempt(Base):
     user_id = Column(String(100))  # Can be session ID or user ID
     
     # Attempt data
-    answers = Column(JSON)  # {"question_1": "answer", ...}
+    answers = Column(JSONType)  # {"question_1": "answer", ...}
     score = Column(Integer)  # Number of correct answers
     total_questions = Column(Integer)
     percentage = Column(Float)
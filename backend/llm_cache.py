@@ -0,0 +1,267 @@
+"""
+Two-tier cache for LLM quiz responses (in-memory LRU + optional Redis)
+and an optional embedding-similarity cache for near-duplicate articles
+"""
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Bounded in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Dict, ttl: int) -> None:
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+class RedisBackend:
+    """Redis-backed cache shared across workers (async client)"""
+
+    def __init__(self, url: str):
+        from redis.asyncio import Redis
+
+        self._client = Redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        raw = await self._client.get(key)
+        return orjson.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Dict, ttl: int) -> None:
+        await self._client.set(key, orjson.dumps(value), ex=ttl)
+
+
+class LLMCache:
+    """
+    Cache for generated quizzes keyed on the article and requested size.
+
+    Lookups hit the in-memory tier first and fall back to Redis when it is
+    enabled; Redis failures are logged and treated as misses so a cache outage
+    never blocks quiz generation.
+    """
+
+    def __init__(self):
+        self.memory = MemoryBackend(max_entries=settings.llm_cache_max_entries)
+        self.redis: Optional[RedisBackend] = None
+        self.stats = {"hits": 0, "misses": 0}
+
+        if settings.redis_enabled and settings.redis_url:
+            try:
+                self.redis = RedisBackend(settings.redis_url)
+            except Exception as e:
+                logger.warning(f"Redis cache unavailable, using in-memory cache only: {e}")
+
+    @staticmethod
+    def make_key(title: str, num_questions: int, content: str) -> str:
+        """Build a stable cache key for a quiz request"""
+        payload = orjson.dumps(
+            {"t": title, "n": num_questions, "c": content[:5000]},
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return "llm:quiz:" + hashlib.sha256(payload).hexdigest()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return cached value or None, updating hit/miss stats"""
+        value = self.memory.get(key)
+
+        if value is None and self.redis:
+            try:
+                value = await self.redis.get(key)
+            except Exception as e:
+                logger.warning(f"Redis cache read failed: {e}")
+            if value is not None:
+                self.memory.set(key, value, settings.cache_ttl)
+
+        if value is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+
+        logger.debug(f"LLM cache hit ratio: {self.hit_ratio:.2%} ({self.stats})")
+        return value
+
+    async def set(self, key: str, value: Dict, ttl: Optional[int] = None) -> None:
+        """Store value in every enabled tier"""
+        ttl = ttl or settings.cache_ttl
+        self.memory.set(key, value, ttl)
+
+        if self.redis:
+            try:
+                await self.redis.set(key, value, ttl)
+            except Exception as e:
+                logger.warning(f"Redis cache write failed: {e}")
+
+
+class SemanticCache:
+    """
+    Embedding-similarity cache for near-duplicate quiz requests.
+
+    Article summaries are embedded with a small local sentence-transformers
+    model and kept as rows of a normalized matrix, so a lookup is a single
+    matrix-vector product. Requires the optional ``sentence-transformers``
+    package; the model is loaded on first use.
+
+    Methods block on the model and on disk I/O, so async callers should run
+    them in a worker thread. New entries are written to disk in batches of
+    ``semantic_cache_save_every`` and once more at interpreter exit.
+    """
+
+    def __init__(self):
+        self.threshold = settings.semantic_cache_threshold
+        self.max_entries = settings.semantic_cache_max_entries
+        self.path = settings.semantic_cache_path
+        self.save_every = settings.semantic_cache_save_every
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._lock = threading.Lock()  # guards the entries below
+        self._emb_matrix = None  # np.ndarray of shape (N, dim)
+        self._num_questions: List[int] = []
+        self._cached_results: List[Dict] = []
+        self._unsaved = 0
+        self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    logger.info(f"Loading embedding model: {settings.semantic_cache_model}")
+                    self._model = SentenceTransformer(settings.semantic_cache_model)
+        return self._model
+
+    def _embed(self, text: str):
+        return self._get_model().encode(text, normalize_embeddings=True)
+
+    def get(self, summary: str, num_questions: int) -> Optional[Dict]:
+        """Return the closest cached result above the similarity threshold"""
+        with self._lock:
+            emb_matrix = self._emb_matrix
+            num_questions_list = list(self._num_questions)
+            results = list(self._cached_results)
+        if emb_matrix is None or not results:
+            return None
+
+        import numpy as np
+
+        query = self._embed(summary)
+        sims = emb_matrix @ query
+        sims[np.asarray(num_questions_list) != num_questions] = -1.0
+
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+
+        logger.info(f"Semantic cache hit (similarity={sims[best]:.3f})")
+        return results[best]
+
+    def set(self, summary: str, num_questions: int, value: Dict) -> None:
+        """Add a result; it is persisted with the next batch if a path is configured"""
+        import numpy as np
+
+        embedding = self._embed(summary).reshape(1, -1)
+        with self._lock:
+            if self._emb_matrix is None:
+                self._emb_matrix = embedding
+            else:
+                self._emb_matrix = np.vstack([self._emb_matrix, embedding])
+            self._num_questions.append(num_questions)
+            self._cached_results.append(value)
+
+            # Drop the oldest entries once over capacity
+            overflow = len(self._cached_results) - self.max_entries
+            if overflow > 0:
+                self._emb_matrix = self._emb_matrix[overflow:]
+                del self._num_questions[:overflow]
+                del self._cached_results[:overflow]
+
+            self._unsaved += 1
+            save_due = self._unsaved >= self.save_every
+
+        if save_due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write unsaved entries to disk if a path is configured"""
+        if not self.path:
+            return
+
+        with self._lock:
+            if not self._unsaved:
+                return
+            emb_matrix = self._emb_matrix
+            data = {"num_questions": list(self._num_questions), "results": list(self._cached_results)}
+            self._unsaved = 0
+
+        self._save(emb_matrix, data)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(os.path.join(self.path, "embeddings.npy")):
+            return
+
+        import numpy as np
+
+        try:
+            self._emb_matrix = np.load(os.path.join(self.path, "embeddings.npy"))
+            with open(os.path.join(self.path, "results.json"), "rb") as f:
+                data = orjson.loads(f.read())
+            self._num_questions = data["num_questions"]
+            self._cached_results = data["results"]
+            logger.info(f"Loaded {len(self._cached_results)} semantic cache entries")
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache: {e}")
+            self._emb_matrix = None
+            self._num_questions = []
+            self._cached_results = []
+
+    def _save(self, emb_matrix, data: Dict) -> None:
+        import numpy as np
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            np.save(os.path.join(self.path, "embeddings.npy"), emb_matrix)
+            with open(os.path.join(self.path, "results.json"), "wb") as f:
+                f.write(orjson.dumps(data))
+        except Exception as e:
+            logger.warning(f"Failed to persist semantic cache: {e}")
+
+
+# Create cache instance
+llm_cache = LLMCache()
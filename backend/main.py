@@ -2,16 +2,19 @@
 Complete API implementation with database integration
 Meets all project requirements
 """
+import importlib.util
 import time
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session, joinedload, selectinload
 from contextlib import asynccontextmanager
 from typing import List, Optional
-from pydantic import BaseModel, HttpUrl, Field
+from pydantic import BaseModel, ConfigDict, HttpUrl, Field
 import logging
+import msgspec
 
 # Import our modules
 from config import settings
@@ -27,6 +30,10 @@ logger = logging.getLogger(__name__)
 # Application start time
 app_start_time = time.time()
 
+# Last database probe as (timestamp, status); reused for HEALTH_CACHE_TTL seconds
+HEALTH_CACHE_TTL = 1.0
+_last_db_health = (0.0, "unhealthy")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -49,6 +56,7 @@ app = FastAPI(
     description="Generate AI-powered quizzes from Wikipedia articles with full history tracking",
     version="2.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS
@@ -67,16 +75,19 @@ class QuizGenerationRequest(BaseModel):
     num_questions: int = Field(default=10, ge=5, le=15, description="Number of questions")
     force_regenerate: bool = Field(default=False, description="Force regeneration even if cached")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "url": "https://en.wikipedia.org/wiki/Alan_Turing",
                 "num_questions": 10,
                 "force_regenerate": False
             }
         }
+    )
 
 
+# Response models below are only ever built from validated requests or DB rows
+# and may be assembled with model_construct(); keep them free of validators.
 class QuizQuestionResponse(BaseModel):
     question: str
     options: List[str]
@@ -84,6 +95,8 @@ class QuizQuestionResponse(BaseModel):
     difficulty: str
     explanation: str
     section: Optional[str] = None
+    
+    model_config = ConfigDict(frozen=True)
 
 
 class QuizResponse(BaseModel):
@@ -97,8 +110,7 @@ class QuizResponse(BaseModel):
     related_topics: List[str]
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 class QuizHistoryItem(BaseModel):
@@ -109,13 +121,38 @@ class QuizHistoryItem(BaseModel):
     total_questions: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+# Output-only msgspec structs mirroring QuizQuestionResponse/QuizResponse,
+# encoded straight to bytes for the large quiz payloads
+class QuizQuestionOut(msgspec.Struct):
+    question: str
+    options: List[str]
+    answer: str
+    difficulty: str
+    explanation: str
+    section: Optional[str] = None
+
+
+class QuizOut(msgspec.Struct):
+    id: int
+    url: str
+    title: str
+    summary: str
+    key_entities: dict
+    sections: List[str]
+    quiz: List[QuizQuestionOut]
+    related_topics: List[str]
+    created_at: datetime
+
+
+_ENCODER = msgspec.json.Encoder()
 
 
 class QuizAttemptRequest(BaseModel):
     quiz_id: int
-    answers: dict = Field(..., description="Question number to answer mapping")
+    answers: dict[int, str] = Field(..., description="Question number to answer mapping")
     time_taken_seconds: int = Field(default=0)
 
 
@@ -128,8 +165,32 @@ class QuizAttemptResponse(BaseModel):
     correct_answers: List[int]
     wrong_answers: List[int]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+def _build_quiz_out(quiz: Quiz, article: WikiArticle) -> QuizOut:
+    """Assemble the quiz payload from stored rows"""
+    return QuizOut(
+        id=quiz.id,
+        url=article.url,
+        title=article.title,
+        summary=article.summary,
+        key_entities=article.key_entities or {},
+        sections=article.sections or [],
+        quiz=[
+            QuizQuestionOut(
+                question=q.question_text,
+                options=[q.option_a, q.option_b, q.option_c, q.option_d],
+                answer=q.correct_answer,
+                difficulty=q.difficulty,
+                explanation=q.explanation or "",
+                section=q.section_reference
+            )
+            for q in quiz.questions
+        ],
+        related_topics=article.related_topics or [],
+        created_at=quiz.created_at
+    )
 
 
 # API Endpoints
@@ -154,13 +215,18 @@ async def root():
 @app.get("/health")
 async def health_check(db: Session = Depends(get_db)):
     """Health check endpoint"""
-    try:
-        # Test database connection
-        db.execute("SELECT 1")
-        db_status = "healthy"
-    except Exception as e:
-        logger.error(f"Database health check failed: {e}")
-        db_status = "unhealthy"
+    global _last_db_health
+    
+    checked_at, db_status = _last_db_health
+    if time.time() - checked_at >= HEALTH_CACHE_TTL:
+        try:
+            # Test database connection
+            db.execute(text("SELECT 1")).scalar()
+            db_status = "healthy"
+        except Exception as e:
+            logger.error(f"Database health check failed: {e}")
+            db_status = "unhealthy"
+        _last_db_health = (time.time(), db_status)
     
     return {
         "status": "healthy" if db_status == "healthy" else "degraded",
@@ -174,7 +240,14 @@ async def health_check(db: Session = Depends(get_db)):
     }
 
 
-@app.post("/api/generate-quiz", response_model=QuizResponse, status_code=status.HTTP_201_CREATED)
+@app.post(
+    "/api/generate-quiz",
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_200_OK: {"model": QuizResponse, "description": "Existing quiz reused"},
+        status.HTTP_201_CREATED: {"model": QuizResponse},
+    }
+)
 async def generate_quiz(
     request: QuizGenerationRequest,
     db: Session = Depends(get_db)
@@ -192,7 +265,8 @@ async def generate_quiz(
     logger.info(f"Quiz generation requested for: {request.url}")
     
     try:
-        # Check if article already exists (caching)
+        # Check if article already exists (caching); the deferred content column
+        # is only loaded if a new quiz has to be generated from it
         existing_article = db.query(WikiArticle).filter(
             WikiArticle.url == request.url
         ).first()
@@ -200,10 +274,28 @@ async def generate_quiz(
         if existing_article and not request.force_regenerate:
             logger.info(f"Using cached article: {existing_article.title}")
             article = existing_article
+            
+            # Reuse the latest quiz of the same size instead of calling the LLM again
+            latest_quiz = db.query(Quiz).options(
+                selectinload(Quiz.questions)
+            ).filter(
+                Quiz.article_id == article.id
+            ).order_by(Quiz.created_at.desc()).first()
+            
+            if latest_quiz and latest_quiz.total_questions == request.num_questions:
+                logger.info(f"✅ Reusing cached quiz: ID={latest_quiz.id}")
+                # Nothing was created, so answer 200 rather than the route's 201
+                return Response(
+                    content=_ENCODER.encode(_build_quiz_out(latest_quiz, article)),
+                    media_type="application/json",
+                    status_code=status.HTTP_200_OK
+                )
         else:
             # Scrape Wikipedia article
             logger.info("Scraping Wikipedia article...")
-            article_data = enhanced_wikipedia_service.scrape_full_article(request.url)
+            article_data = enhanced_wikipedia_service.scrape_full_article(
+                request.url, include_raw_html=True, refresh=request.force_regenerate
+            )
             
             if existing_article:
                 # Update existing article
@@ -229,16 +321,16 @@ async def generate_quiz(
                 )
                 db.add(article)
                 db.commit()
-                db.refresh(article)
         
         # Generate quiz with AI
         logger.info("Generating quiz with AI...")
-        quiz_data = enhanced_ai_service.generate_comprehensive_quiz(
+        quiz_data = await enhanced_ai_service.generate_comprehensive_quiz(
             title=article.title,
             summary=article.summary,
             content=article.content,
             sections=article.sections or [],
-            num_questions=request.num_questions
+            num_questions=request.num_questions,
+            refresh=request.force_regenerate
         )
         
         # Store quiz in database
@@ -251,58 +343,64 @@ async def generate_quiz(
         )
         db.add(quiz)
         db.commit()
-        db.refresh(quiz)
         
-        # Store questions
-        for i, q_data in enumerate(quiz_data["questions"]):
-            question = QuizQuestion(
-                quiz_id=quiz.id,
-                question_number=i + 1,
-                question_text=q_data["question"],
-                option_a=q_data["options"][0] if len(q_data["options"]) > 0 else "",
-                option_b=q_data["options"][1] if len(q_data["options"]) > 1 else "",
-                option_c=q_data["options"][2] if len(q_data["options"]) > 2 else "",
-                option_d=q_data["options"][3] if len(q_data["options"]) > 3 else "",
-                correct_answer=q_data["answer"],
-                explanation=q_data.get("explanation", ""),
-                difficulty=q_data["difficulty"],
-                section_reference=q_data.get("section", "")
-            )
-            db.add(question)
+        # Normalise each question once for both the INSERT rows and the response
+        question_rows = []
+        questions_out = []
+        for i, q_data in enumerate(quiz_data["questions"], 1):
+            options = (q_data["options"] + ["", "", "", ""])[:4]
+            explanation = q_data.get("explanation", "")
+            section = q_data.get("section")
+            question_rows.append({
+                "quiz_id": quiz.id,
+                "question_number": i,
+                "question_text": q_data["question"],
+                "option_a": options[0],
+                "option_b": options[1],
+                "option_c": options[2],
+                "option_d": options[3],
+                "correct_answer": q_data["answer"],
+                "explanation": explanation,
+                "difficulty": q_data["difficulty"],
+                "section_reference": section or ""
+            })
+            questions_out.append({
+                "question": q_data["question"],
+                "options": options,
+                "answer": q_data["answer"],
+                "difficulty": q_data["difficulty"],
+                "explanation": explanation,
+                "section": section
+            })
+        
+        # Store questions in one batched INSERT
+        db.bulk_insert_mappings(QuizQuestion, question_rows)
         
         # Update article with related topics
         article.related_topics = quiz_data["related_topics"]
         
         db.commit()
         
-        # Build response
-        quiz_questions = [
-            QuizQuestionResponse(
-                question=q_data["question"],
-                options=q_data["options"],
-                answer=q_data["answer"],
-                difficulty=q_data["difficulty"],
-                explanation=q_data.get("explanation", ""),
-                section=q_data.get("section")
-            )
-            for q_data in quiz_data["questions"]
-        ]
-        
-        response = QuizResponse(
-            id=quiz.id,
-            url=article.url,
-            title=article.title,
-            summary=article.summary,
-            key_entities=article.key_entities or {},
-            sections=article.sections or [],
-            quiz=quiz_questions,
-            related_topics=quiz_data["related_topics"],
-            created_at=quiz.created_at
-        )
+        # Build response as plain dicts; encoded once with no intermediate models
+        response = {
+            "id": quiz.id,
+            "url": article.url,
+            "title": article.title,
+            "summary": article.summary,
+            "key_entities": article.key_entities or {},
+            "sections": article.sections or [],
+            "quiz": questions_out,
+            "related_topics": quiz_data["related_topics"],
+            "created_at": quiz.created_at
+        }
         
         logger.info(f"✅ Quiz generated successfully: ID={quiz.id}")
-        return response
-        
+        return Response(
+            content=_ENCODER.encode(response),
+            media_type="application/json",
+            status_code=status.HTTP_201_CREATED
+        )
+    
     except Exception as e:
         logger.error(f"Failed to generate quiz: {e}")
         db.rollback()
@@ -312,43 +410,42 @@ async def generate_quiz(
         )
 
 
-@app.get("/api/quiz/{quiz_id}", response_model=QuizResponse)
-async def get_quiz(quiz_id: int, db: Session = Depends(get_db)):
+def _quiz_etag(quiz_id: int, created_at: datetime) -> str:
+    """Quizzes are immutable once created, so id + creation time identify a version"""
+    return f'W/"{quiz_id}-{int(created_at.timestamp())}"'
+
+
+@app.get("/api/quiz/{quiz_id}", responses={200: {"model": QuizResponse}})
+async def get_quiz(quiz_id: int, request: Request, db: Session = Depends(get_db)):
     """Get full quiz details by ID"""
     
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
-    if not quiz:
+    created_at = db.query(Quiz.created_at).filter(Quiz.id == quiz_id).scalar()
+    if created_at is None:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
-    article = quiz.article
-    questions = sorted(quiz.questions, key=lambda q: q.question_number)
+    # Quizzes can be deleted, so every use is revalidated (cheap via the ETag)
+    # and shared caches never keep a copy
+    etag = _quiz_etag(quiz_id, created_at)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
     
-    quiz_questions = [
-        QuizQuestionResponse(
-            question=q.question_text,
-            options=[q.option_a, q.option_b, q.option_c, q.option_d],
-            answer=q.correct_answer,
-            difficulty=q.difficulty,
-            explanation=q.explanation or "",
-            section=q.section_reference
-        )
-        for q in questions
-    ]
+    quiz = db.query(Quiz).options(
+        selectinload(Quiz.questions),
+        joinedload(Quiz.article)
+    ).filter(Quiz.id == quiz_id).first()
+    if not quiz:
+        raise HTTPException(status_code=404, detail="Quiz not found")
     
-    return QuizResponse(
-        id=quiz.id,
-        url=article.url,
-        title=article.title,
-        summary=article.summary,
-        key_entities=article.key_entities or {},
-        sections=article.sections or [],
-        quiz=quiz_questions,
-        related_topics=article.related_topics or [],
-        created_at=quiz.created_at
+    response = _build_quiz_out(quiz, quiz.article)
+    return Response(
+        content=_ENCODER.encode(response),
+        media_type="application/json",
+        headers=cache_headers
     )
 
 
-@app.get("/api/quizzes", response_model=List[QuizHistoryItem])
+@app.get("/api/quizzes", responses={200: {"model": List[QuizHistoryItem]}})
 async def list_quizzes(
     skip: int = 0,
     limit: int = 50,
@@ -358,24 +455,22 @@ async def list_quizzes(
     List all quizzes (history view)
     Returns summary information for all generated quizzes
     """
-    quizzes = db.query(Quiz).join(WikiArticle).order_by(
+    # Project only the listed columns; no Quiz/WikiArticle objects are hydrated
+    rows = db.query(
+        Quiz.id,
+        Quiz.article_id,
+        WikiArticle.url,
+        WikiArticle.title,
+        Quiz.total_questions,
+        Quiz.created_at
+    ).join(WikiArticle, Quiz.article_id == WikiArticle.id).order_by(
         Quiz.created_at.desc()
     ).offset(skip).limit(limit).all()
     
-    return [
-        QuizHistoryItem(
-            id=quiz.id,
-            article_id=quiz.article_id,
-            url=quiz.article.url,
-            title=quiz.article.title,
-            total_questions=quiz.total_questions,
-            created_at=quiz.created_at
-        )
-        for quiz in quizzes
-    ]
+    return ORJSONResponse([row._asdict() for row in rows])
 
 
-@app.post("/api/quiz/attempt", response_model=QuizAttemptResponse)
+@app.post("/api/quiz/attempt", responses={200: {"model": QuizAttemptResponse}})
 async def submit_quiz_attempt(
     request: QuizAttemptRequest,
     db: Session = Depends(get_db)
@@ -383,22 +478,26 @@ async def submit_quiz_attempt(
     """
     Submit quiz attempt and calculate score
     """
-    quiz = db.query(Quiz).filter(Quiz.id == request.quiz_id).first()
+    quiz = db.query(Quiz).options(
+        selectinload(Quiz.questions)
+    ).filter(Quiz.id == request.quiz_id).first()
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
-    questions = sorted(quiz.questions, key=lambda q: q.question_number)
+    questions = quiz.questions
     
     # Calculate score
+    answers = request.answers
     correct = []
     wrong = []
+    add_correct = correct.append
+    add_wrong = wrong.append
     
     for q in questions:
-        user_answer = request.answers.get(str(q.question_number))
-        if user_answer == q.correct_answer:
-            correct.append(q.question_number)
+        if answers.get(q.question_number) == q.correct_answer:
+            add_correct(q.question_number)
         else:
-            wrong.append(q.question_number)
+            add_wrong(q.question_number)
     
     score = len(correct)
     total = len(questions)
@@ -414,11 +513,20 @@ async def submit_quiz_attempt(
         time_taken_seconds=request.time_taken_seconds,
         completed_at=datetime.utcnow()
     )
-    db.add(attempt)
-    db.commit()
-    db.refresh(attempt)
+    try:
+        db.add(attempt)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Failed to store quiz attempt: {e}")
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={"error": "QuizAttemptError", "message": "Failed to store quiz attempt"}
+        )
     
-    return QuizAttemptResponse(
+    # Scores are computed server-side, so skip re-validating them; returning a
+    # Response directly also keeps FastAPI from validating the model again
+    return ORJSONResponse(QuizAttemptResponse.model_construct(
         id=attempt.id,
         quiz_id=quiz.id,
         score=score,
@@ -426,17 +534,20 @@ async def submit_quiz_attempt(
         percentage=percentage,
         correct_answers=correct,
         wrong_answers=wrong
-    )
+    ).model_dump())
 
 
 @app.delete("/api/quiz/{quiz_id}")
 async def delete_quiz(quiz_id: int, db: Session = Depends(get_db)):
     """Delete a quiz and its associated data"""
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
-    if not quiz:
+    # Bulk DELETEs instead of the ORM cascade, which loads every child row first
+    db.query(QuizQuestion).filter(QuizQuestion.quiz_id == quiz_id).delete(synchronize_session=False)
+    db.query(QuizAttempt).filter(QuizAttempt.quiz_id == quiz_id).delete(synchronize_session=False)
+    deleted = db.query(Quiz).filter(Quiz.id == quiz_id).delete(synchronize_session=False)
+    if not deleted:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Quiz not found")
     
-    db.delete(quiz)
     db.commit()
     
     return {"message": "Quiz deleted successfully"}
@@ -449,10 +560,15 @@ if __name__ == "__main__":
     logger.info(f"📝 API Documentation: http://{settings.host}:{settings.port}/docs")
     logger.info(f"🔍 Health Check: http://{settings.host}:{settings.port}/health")
     
+    # Prefer uvloop/httptools when installed (uvloop has no Windows build).
+    # This dev entry point runs a single worker, which is what the in-process
+    # article and quiz caches assume; scale out with the uvicorn CLI instead.
     uvicorn.run(
-        "main_complete:app",
+        "main:app",
         host=settings.host,
         port=settings.port,
-        reload=True,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        reload=settings.debug,
         log_level="info"
     )
@@ -1,16 +1,70 @@
 """
 Enhanced Wikipedia service with entity extraction and section parsing
 """
+import asyncio
+import httpx
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import re
 from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
 import logging
 from tenacity import retry, stop_after_attempt, wait_exponential
 import time
 
+from config import settings
+from llm_cache import MemoryBackend
+
 logger = logging.getLogger(__name__)
 
+_CITATION_RE = re.compile(r'\[\d+\]')
+# Runs of whitespace and [n] citation markers, cleaned up together by _clean_text
+_CLEANUP_RE = re.compile(r'(?:\s|\[\d+\])+')
+# Hard cap on article HTML read from the wire; anything past it is dropped
+_MAX_HTML_BYTES = 2_000_000
+_READ_CHUNK_BYTES = 64 * 1024
+
+# Words near a link that suggest it names a person (birth/death dates, "was a ...")
+_PERSON_CONTEXT_RE = re.compile(r'born|died|\(|–|was a', re.IGNORECASE)
+# Keywords in a link's text / title that mark an organization / a location
+_ORG_KEYWORD_RE = re.compile(r'University|Institute|Company|Corporation|Organization|Society|Association')
+_LOCATION_KEYWORD_RE = re.compile(r'Country|City|State|Province')
+
+# Common location names for entity extraction, as they appear in link titles
+_COMMON_LOCATIONS = frozenset({
+    'United States', 'United Kingdom', 'Germany', 'France', 'Japan',
+    'China', 'India', 'Russia', 'Canada', 'Australia',
+    'London', 'New York', 'Paris', 'Tokyo', 'Berlin',
+    'Cambridge', 'Oxford', 'Princeton', 'Harvard'
+})
+
+
+def _collapse_run(match: re.Match) -> str:
+    # Citations alone vanish; a run containing any whitespace becomes one space
+    return ' ' if match.group(0).strip('[]0123456789') else ''
+
+
+def _clean_text(text: str) -> str:
+    """Drop citation markers and collapse whitespace in a single regex pass"""
+    return _CLEANUP_RE.sub(_collapse_run, text)
+
+
+def _pick_parser() -> str:
+    """Prefer the C-based lxml parser; fall back to the stdlib one if it isn't installed"""
+    try:
+        import lxml  # noqa: F401
+        
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+_HTML_PARSER = _pick_parser()
+
+# Only the title heading and article body (which holds the infobox) are ever read
+_ARTICLE_STRAINER = SoupStrainer(['h1', 'div'], attrs={'id': ['firstHeading', 'mw-content-text']})
+
 
 class EnhancedWikipediaService:
     """
@@ -19,72 +73,222 @@ class EnhancedWikipediaService:
     
     def __init__(self):
         self.session = requests.Session()
+        # Keep connections alive and pooled across scrapes (retries are left to tenacity)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'User-Agent': 'WikiQuizBot/2.0 (Educational Purpose; +https://github.com/Abhich05/Wiki-Quiz-Genrator)'
         })
         self.timeout = 15
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # Scrapes keyed on normalized URL so repeat topics skip the fetch and parse
+        self._cache = MemoryBackend(max_entries=settings.wikipedia_cache_max_entries)
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10)
-    )
-    def scrape_full_article(self, url: str) -> Dict:
+    def scrape_full_article(self, url: str, include_raw_html: bool = False, refresh: bool = False) -> Dict:
         """
         Scrape complete Wikipedia article with all metadata
         
+        Results are cached per normalized URL for WIKIPEDIA_CACHE_TTL seconds.
+        The cache never holds raw_html, so include_raw_html always fetches.
+        
+        Args:
+            url: Article URL or topic name
+            include_raw_html: Also return the page HTML (for callers that persist it)
+            refresh: Skip the cache lookup and fetch the article again
+        
         Returns:
             Dict containing:
             - title: Article title
-            - summary: First paragraph
+            - summary: Lead extract from the REST API (first paragraph as fallback)
             - content: Full article text
             - sections: List of section titles
-            - raw_html: Original HTML
+            - raw_html: Original HTML, only when include_raw_html is set
             - key_entities: Extracted entities
             - infobox: Structured data from infobox
         """
+        url = self._normalize_url(url)
+        if not (refresh or include_raw_html):
+            cached = self._get_cached(url)
+            if cached is not None:
+                return cached
+        
+        article = self._scrape_full_article(url, include_raw_html)
+        self._store_cached(url, article)
+        return article
+    
+    async def scrape_full_article_async(
+        self,
+        url: str,
+        include_raw_html: bool = False,
+        refresh: bool = False
+    ) -> Dict:
+        """Async variant of scrape_full_article, sharing the same cache"""
+        url = self._normalize_url(url)
+        if not (refresh or include_raw_html):
+            cached = self._get_cached(url)
+            if cached is not None:
+                return cached
+        
+        article = await self._scrape_full_article_async(url, include_raw_html)
+        self._store_cached(url, article)
+        return article
+    
+    def _get_cached(self, url: str) -> Optional[Dict]:
+        """Return a cached scrape (without raw_html), or None"""
+        cached = self._cache.get(url)
+        if cached is not None:
+            logger.info(f"Article cache hit: {url}")
+        return cached
+    
+    def _store_cached(self, url: str, article: Dict):
+        """Cache a scrape, leaving out raw_html to keep entries small"""
+        entry = {key: value for key, value in article.items() if key != 'raw_html'}
+        self._cache.set(url, entry, settings.wikipedia_cache_ttl)
+    
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10)
+    )
+    def _scrape_full_article(self, url: str, include_raw_html: bool) -> Dict:
+        """Fetch and parse an article (normalized URL), bypassing the cache"""
         logger.info(f"Scraping Wikipedia article: {url}")
         start_time = time.time()
         
         try:
-            # Validate and normalize URL
-            url = self._normalize_url(url)
-            
-            # Fetch article
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract data
-            title = self._extract_title(soup)
-            summary = self._extract_summary(soup)
-            content, sections = self._extract_content_and_sections(soup)
-            key_entities = self._extract_entities(soup, content)
-            infobox = self._extract_infobox(soup)
+            # Fetch article, streaming so oversized pages are cut at _MAX_HTML_BYTES
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                chunks = response.iter_content(chunk_size=_READ_CHUNK_BYTES)
+                html = self._decode_capped(chunks, response.encoding, url)
+            summary = self._fetch_rest_summary(url)
             
-            processing_time = time.time() - start_time
+            return self._build_article(url, html, summary, start_time, include_raw_html)
             
-            logger.info(f"Successfully scraped article: {title} ({processing_time:.2f}s)")
+        except requests.RequestException as e:
+            logger.error(f"Failed to scrape article: {e}")
+            raise Exception(f"Failed to fetch Wikipedia article: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error processing article: {e}")
+            raise Exception(f"Error processing article content: {str(e)}")
+    
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10)
+    )
+    async def _scrape_full_article_async(self, url: str, include_raw_html: bool) -> Dict:
+        """
+        Async variant of _scrape_full_article
+        
+        The page and its REST summary are fetched concurrently; HTML parsing
+        runs in a worker thread so it doesn't block the event loop.
+        """
+        logger.info(f"Scraping Wikipedia article: {url}")
+        start_time = time.time()
+        
+        try:
+            html, summary = await asyncio.gather(
+                self._fetch_html_async(url),
+                self._fetch_rest_summary_async(url)
+            )
             
-            return {
-                "url": url,
-                "title": title,
-                "summary": summary,
-                "content": content,
-                "sections": sections,
-                "raw_html": response.text,
-                "key_entities": key_entities,
-                "infobox": infobox,
-                "processing_time": processing_time
-            }
+            return await asyncio.to_thread(
+                self._build_article, url, html, summary, start_time, include_raw_html
+            )
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Failed to scrape article: {e}")
             raise Exception(f"Failed to fetch Wikipedia article: {str(e)}")
         except Exception as e:
             logger.error(f"Error processing article: {e}")
             raise Exception(f"Error processing article content: {str(e)}")
     
+    async def scrape_many(self, urls: List[str]) -> List[Dict]:
+        """Scrape several articles concurrently over one pooled async client"""
+        return await asyncio.gather(*[self.scrape_full_article_async(url) for url in urls])
+    
+    async def aclose(self):
+        """Close the async HTTP client, if one was opened"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
+    async def _fetch_html_async(self, url: str) -> str:
+        """Stream an article page, stopping at _MAX_HTML_BYTES"""
+        async with self._get_async_client().stream('GET', url) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes(_READ_CHUNK_BYTES):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= _MAX_HTML_BYTES:
+                    break
+            return self._decode_capped(chunks, response.encoding, url)
+    
+    def _decode_capped(self, chunks, encoding: Optional[str], url: str) -> str:
+        """Join body chunks up to _MAX_HTML_BYTES and decode them"""
+        body = bytearray()
+        for chunk in chunks:
+            body += chunk
+            if len(body) >= _MAX_HTML_BYTES:
+                logger.warning(f"Article HTML over {_MAX_HTML_BYTES} bytes, truncating: {url}")
+                del body[_MAX_HTML_BYTES:]
+                break
+        return body.decode(encoding or 'utf-8', errors='replace')
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Create the shared async client on first use"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                http2=True,
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={'User-Agent': self.session.headers['User-Agent']},
+                limits=httpx.Limits(max_keepalive_connections=20)
+            )
+        return self._async_client
+    
+    def _build_article(
+        self,
+        url: str,
+        html: str,
+        summary: Optional[str],
+        start_time: float,
+        include_raw_html: bool
+    ) -> Dict:
+        """Parse a fetched article page into the scrape result dict"""
+        soup = BeautifulSoup(html, _HTML_PARSER, parse_only=_ARTICLE_STRAINER)
+        
+        # Locate the shared subtrees once and hand them to each extractor
+        content_div = soup.find('div', {'id': 'mw-content-text'})
+        infobox_table = content_div.find('table', {'class': 'infobox'}) if content_div else None
+        
+        # Extract data (infobox first: content cleanup decomposes tables)
+        title = self._extract_title(soup)
+        infobox = self._extract_infobox(infobox_table)
+        summary = summary or self._extract_summary(content_div)
+        content, sections = self._extract_content_and_sections(content_div)
+        key_entities = self._extract_entities(content_div)
+        
+        processing_time = time.time() - start_time
+        
+        logger.info(f"Successfully scraped article: {title} ({processing_time:.2f}s)")
+        
+        article = {
+            "url": url,
+            "title": title,
+            "summary": summary,
+            "content": content,
+            "sections": sections,
+            "key_entities": key_entities,
+            "infobox": infobox,
+            "processing_time": processing_time
+        }
+        if include_raw_html:
+            article["raw_html"] = html
+        return article
+    
     def _normalize_url(self, url: str) -> str:
         """Normalize Wikipedia URL"""
         if url.startswith('http'):
@@ -93,6 +297,48 @@ class EnhancedWikipediaService:
         topic = url.strip().replace(' ', '_')
         return f"https://en.wikipedia.org/wiki/{topic}"
     
+    def _summary_api_url(self, url: str) -> Optional[str]:
+        """Map a /wiki/ article URL to its Wikimedia REST summary endpoint"""
+        parts = urlsplit(url)
+        if not parts.path.startswith('/wiki/'):
+            return None
+        
+        title = quote(unquote(parts.path[len('/wiki/'):]), safe='')
+        return f"{parts.scheme}://{parts.netloc}/api/rest_v1/page/summary/{title}"
+    
+    def _fetch_rest_summary(self, url: str) -> Optional[str]:
+        """
+        Fetch the article's lead extract from the Wikimedia REST summary API
+        
+        Returns None when the URL isn't a /wiki/ article or the API call fails,
+        so the caller can fall back to the scraped HTML.
+        """
+        api_url = self._summary_api_url(url)
+        if api_url is None:
+            return None
+        
+        try:
+            response = self.session.get(api_url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json().get('extract') or None
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"REST summary unavailable for {url}, using page HTML: {e}")
+            return None
+    
+    async def _fetch_rest_summary_async(self, url: str) -> Optional[str]:
+        """Async variant of _fetch_rest_summary"""
+        api_url = self._summary_api_url(url)
+        if api_url is None:
+            return None
+        
+        try:
+            response = await self._get_async_client().get(api_url)
+            response.raise_for_status()
+            return response.json().get('extract') or None
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"REST summary unavailable for {url}, using page HTML: {e}")
+            return None
+    
     def _extract_title(self, soup: BeautifulSoup) -> str:
         """Extract article title"""
         title_elem = soup.find('h1', {'id': 'firstHeading'})
@@ -100,9 +346,8 @@ class EnhancedWikipediaService:
             return title_elem.get_text().strip()
         return "Unknown Title"
     
-    def _extract_summary(self, soup: BeautifulSoup) -> str:
+    def _extract_summary(self, content_div: Optional[Tag]) -> str:
         """Extract first paragraph as summary"""
-        content_div = soup.find('div', {'id': 'mw-content-text'})
         if not content_div:
             return ""
         
@@ -112,24 +357,23 @@ class EnhancedWikipediaService:
             text = p.get_text().strip()
             if len(text) > 100 and not text.startswith('Coordinates:'):
                 # Clean up citation markers
-                text = re.sub(r'\[\d+\]', '', text)
+                text = _CITATION_RE.sub('', text)
                 return text
         
         return ""
     
-    def _extract_content_and_sections(self, soup: BeautifulSoup) -> Tuple[str, List[str]]:
+    def _extract_content_and_sections(self, content_div: Optional[Tag]) -> Tuple[str, List[str]]:
         """
         Extract main content and section titles
         
         Returns:
             Tuple of (full_content, section_titles)
         """
-        content_div = soup.find('div', {'id': 'mw-content-text'})
         if not content_div:
             return "", []
         
         # Remove unwanted elements
-        for element in content_div.find_all(['script', 'style', 'table', '.navbox', '.ambox', '.mw-editsection']):
+        for element in content_div.select('script, style, table, .navbox, .ambox, .mw-editsection'):
             element.decompose()
         
         # Extract sections
@@ -148,15 +392,15 @@ class EnhancedWikipediaService:
         
         # Get all paragraphs
         paragraphs = content_div.find_all('p')
-        full_content = '\n\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+        texts = (p.get_text().strip() for p in paragraphs)  # one subtree walk per paragraph
+        full_content = '\n\n'.join(text for text in texts if text)
         
         # Clean up content
-        full_content = re.sub(r'\[\d+\]', '', full_content)  # Remove citations
-        full_content = re.sub(r'\s+', ' ', full_content)  # Normalize whitespace
+        full_content = _clean_text(full_content)  # Remove citations, normalize whitespace
         
         return full_content, sections
     
-    def _extract_entities(self, soup: BeautifulSoup, content: str) -> Dict[str, List[str]]:
+    def _extract_entities(self, content_div: Optional[Tag]) -> Dict[str, List[str]]:
         """
         Extract key entities from article
         
@@ -169,16 +413,19 @@ class EnhancedWikipediaService:
             "locations": []
         }
         
-        # Extract from infobox and content links
-        content_div = soup.find('div', {'id': 'mw-content-text'})
+        # Extract from content links
         if not content_div:
             return entities
         
-        # Find all wiki links
-        links = content_div.find_all('a', href=re.compile(r'^/wiki/'))
+        # Find the first 50 wiki links
+        links = content_div.select('a[href^="/wiki/"]', limit=50)
         seen = set()
+        # Names already collected per category, so duplicates are dropped as we go
+        seen_names = {category: set() for category in entities}
+        # Links in the same paragraph share a parent; check its text once
+        person_context: Dict[int, bool] = {}
         
-        for link in links[:50]:  # Limit to first 50 links
+        for link in links:
             title = link.get('title', '')
             text = link.get_text().strip()
             
@@ -189,39 +436,36 @@ class EnhancedWikipediaService:
             
             # Simple heuristic classification
             # People: often have birth/death dates nearby
-            parent_text = link.parent.get_text() if link.parent else ''
+            parent = link.parent
+            if id(parent) not in person_context:
+                person_context[id(parent)] = bool(_PERSON_CONTEXT_RE.search(parent.get_text()))
             
-            if any(pattern in parent_text.lower() for pattern in ['born', 'died', '(', '–', 'was a']):
+            category = None
+            if person_context[id(parent)]:
                 if text and len(text.split()) <= 4:  # Likely a person name
-                    entities["people"].append(text)
+                    category = "people"
             
             # Organizations: University, Company, Institute, etc.
-            elif any(keyword in text for keyword in ['University', 'Institute', 'Company', 'Corporation', 'Organization', 'Society', 'Association']):
-                entities["organizations"].append(text)
+            elif _ORG_KEYWORD_RE.search(text):
+                category = "organizations"
             
             # Locations: Countries, cities, etc.
-            elif any(keyword in title for keyword in ['Country', 'City', 'State', 'Province']) or title in self._get_common_locations():
-                entities["locations"].append(text)
-        
-        # Deduplicate and limit
-        entities["people"] = list(dict.fromkeys(entities["people"]))[:10]
-        entities["organizations"] = list(dict.fromkeys(entities["organizations"]))[:10]
-        entities["locations"] = list(dict.fromkeys(entities["locations"]))[:10]
+            elif _LOCATION_KEYWORD_RE.search(title) or title in _COMMON_LOCATIONS:
+                category = "locations"
+            
+            # Deduplicate and limit to 10 per category
+            if category is None or text in seen_names[category] or len(entities[category]) >= 10:
+                continue
+            seen_names[category].add(text)
+            entities[category].append(text)
+            
+            if all(len(names) >= 10 for names in entities.values()):
+                break
         
         return entities
     
-    def _get_common_locations(self) -> set:
-        """Common location names for entity extraction"""
-        return {
-            'United_States', 'United_Kingdom', 'Germany', 'France', 'Japan', 
-            'China', 'India', 'Russia', 'Canada', 'Australia',
-            'London', 'New_York', 'Paris', 'Tokyo', 'Berlin',
-            'Cambridge', 'Oxford', 'Princeton', 'Harvard'
-        }
-    
-    def _extract_infobox(self, soup: BeautifulSoup) -> Dict:
+    def _extract_infobox(self, infobox: Optional[Tag]) -> Dict:
         """Extract structured data from infobox"""
-        infobox = soup.find('table', {'class': 'infobox'})
         if not infobox:
             return {}
         
@@ -236,8 +480,7 @@ class EnhancedWikipediaService:
                 key = th.get_text().strip()
                 value = td.get_text().strip()
                 # Clean up
-                value = re.sub(r'\[\d+\]', '', value)
-                value = re.sub(r'\s+', ' ', value)
+                value = _clean_text(value)
                 data[key] = value
         
         return data